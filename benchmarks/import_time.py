@@ -0,0 +1,70 @@
+"""
+How long it takes a fresh interpreter to load the twill extension.
+
+Every short twill process pays for importing testmailclient.  For each
+sample this starts a new Python, imports twill (untimed, since every
+script needs it anyway) and then times:
+
+  checking   import testmailclient (all a mail-checking script loads)
+  sending    ... + import testmailclient.smtp2zope (loaded by send_mail)
+
+The difference between the two is what scripts that never send mail
+save by not loading the sender, its locking and syslog.
+
+  python benchmarks/import_time.py [--samples 20]
+"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ('checking', 'import testmailclient'),
+    ('sending', 'import testmailclient; import testmailclient.smtp2zope'),
+    ]
+
+TEMPLATE = '''\
+import time
+import twill.commands
+started = time.time()
+%s
+print time.time() - started
+'''
+
+def sample(code, samples):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + filter(None, [env.get('PYTHONPATH')]))
+    times = []
+    devnull = open(os.devnull, 'w')
+    try:
+        for i in range(samples):
+            process = subprocess.Popen(
+                [sys.executable, '-c', TEMPLATE % code],
+                env=env, stdout=subprocess.PIPE, stderr=devnull)
+            output = process.communicate()[0]
+            if process.returncode:
+                raise RuntimeError('%r failed' % code)
+            times.append(float(output.split()[-1]))
+    finally:
+        devnull.close()
+    times.sort()
+    return times[len(times) // 2]
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [--samples N]')
+    parser.add_option('--samples', type='int', default=20)
+    options, args = parser.parse_args(argv)
+    medians = {}
+    for name, code in CASES:
+        medians[name] = sample(code, options.samples)
+        print '%-10s %8.2f ms (median of %d)' % (
+            name, medians[name] * 1000, options.samples)
+    print 'saved by not loading the sender: %.2f ms' % (
+        (medians['sending'] - medians['checking']) * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+A local harness for testmailclient.listener.
+
+Starts a MailReceiver that only knows the list "bench", and a
+MailListener in front of it, both in-process.  It first checks the
+reply for each way a delivery can end, over SMTP and LMTP, then times
+delivering mails through the listener against what an MTA pays today:
+a new Python per mail, importing the sender and calling send().
+
+  python benchmarks/listener.py [--count 200]
+"""
+
+import os
+import shutil
+import smtplib
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from testmailclient.listener import MailListener
+from testmailclient.receiver import MailReceiver, synthetic_mail
+
+URL = '%slists/{list}/manage_mailboxer'
+MAX_BYTES = 64 * 1024
+
+# (description, recipient, mail, expected reply code)
+CASES = [
+    ('delivered', 'bench@lists.example.org', synthetic_mail(0), 250),
+    ('unknown list', 'nosuch@lists.example.org', synthetic_mail(1), 550),
+    ('too big', 'bench@lists.example.org',
+     synthetic_mail(2, 2 * MAX_BYTES), 552),
+    ]
+
+def check(receiver, lmtp):
+    listener = MailListener(URL % receiver.url, lmtp=lmtp,
+                            maxBytes=MAX_BYTES).start()
+    failures = 0
+    try:
+        host, port = listener.address
+        if lmtp:
+            client = smtplib.LMTP(host, port)
+        else:
+            client = smtplib.SMTP(host, port)
+        for description, recipient, mail, expected in CASES:
+            try:
+                client.sendmail('owner@example.org', [recipient], mail)
+                code = 250
+            except smtplib.SMTPRecipientsRefused, e:
+                code = e.recipients[recipient][0]
+            except smtplib.SMTPDataError, e:
+                code = e.smtp_code
+            ok = code == expected
+            failures += not ok
+            print '%-5s %-13s %s %s' % (lmtp and 'LMTP' or 'SMTP',
+                                        description, code,
+                                        ok and 'ok' or 'expected %s' % expected)
+        # A listener that had gone unanswered would show up here.
+        client.quit()
+    finally:
+        listener.stop()
+    return failures
+
+SPAWN = '''\
+import sys
+sys.path.insert(0, %r)
+from testmailclient.smtp2zope import send
+send(sys.argv[1], sys.stdin.read())
+'''
+
+def time_spawned(url, mail, count):
+    started = time.time()
+    for i in range(count):
+        process = subprocess.Popen([sys.executable, '-c', SPAWN % ROOT, url],
+                                   stdin=subprocess.PIPE)
+        process.communicate(mail)
+        if process.returncode:
+            raise RuntimeError('smtp2zope exited with %s' % process.returncode)
+    return time.time() - started
+
+def time_listener(receiver, mail, count):
+    listener = MailListener(URL % receiver.url).start()
+    try:
+        client = smtplib.SMTP(*listener.address)
+        started = time.time()
+        for i in range(count):
+            client.sendmail('owner@example.org',
+                            ['bench@lists.example.org'], mail)
+        elapsed = time.time() - started
+        client.quit()
+        return elapsed
+    finally:
+        listener.stop()
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [--count N]')
+    parser.add_option('--count', type='int', default=200)
+    parser.add_option('--spawn-count', type='int', default=20,
+                      help='mails to deliver a process at a time')
+    options, args = parser.parse_args(argv)
+    spool = tempfile.mkdtemp(prefix='testmailclient-listener-')
+    receiver = MailReceiver(spool, lists=['bench']).start()
+    try:
+        failures = check(receiver, False) + check(receiver, True)
+        mail = synthetic_mail(0)
+        spawned = time_spawned(URL.replace('{list}', 'bench') % receiver.url,
+                               mail, options.spawn_count)
+        listened = time_listener(receiver, mail, options.count)
+    finally:
+        receiver.stop()
+        shutil.rmtree(spool, ignore_errors=True)
+    print
+    print 'process per mail %8.2f ms/mail' % (spawned / options.spawn_count * 1000)
+    print 'listener         %8.2f ms/mail' % (listened / options.count * 1000)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,436 @@
+"""
+Benchmarks for the hot paths of testmailclient.
+
+Everything runs locally: mails are posted to an in-process
+testmailclient.receiver.MailReceiver, and the mail commands read
+synthetic spools written by testmailclient.receiver.write_spool.
+
+  python benchmarks/run.py [--sizes 10,100,1000] [--full]
+                           [--output results.json] [--compare old.json]
+                           [--only select]
+
+Each result is the best of several runs.  Results are written as JSON
+so that runs can be compared with --compare.
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import testmailclient
+from testmailclient import smtp2zope
+from testmailclient.reader import read_mail
+from testmailclient.receiver import MailReceiver, synthetic_mail, write_spool
+from testmailclient.session import MailSession
+from testmailclient.spool import DirectorySource
+
+BENCHMARKS = []
+
+def benchmark(fn):
+    BENCHMARKS.append(fn)
+    return fn
+
+def best_of(repeat, fn):
+    best = None
+    for i in range(repeat):
+        started = time.time()
+        fn()
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def result(ops, seconds, **extra):
+    row = {'ops': ops, 'seconds': seconds,
+           'ops_per_sec': seconds and ops / seconds or None}
+    row.update(extra)
+    return row
+
+def fresh_state(spool):
+    """Point the mail commands at spool, with nothing cached."""
+    testmailclient._mail_source = DirectorySource(spool)
+    testmailclient.clear_mail_cache()
+
+@benchmark
+def send(options, tmpdir):
+    server = MailReceiver(os.path.join(tmpdir, 'received')).start()
+    try:
+        url = server.url + 'lists/bench/manage_mailboxer'
+        count = options.send_count
+        mails = [synthetic_mail(i) for i in range(count)]
+        mailpath = write_spool(os.path.join(tmpdir, 'outgoing'), 1)[0]
+        results = {}
+        results['send'] = result(count, best_of(options.repeat, lambda: [
+                    testmailclient.send(url, mail) for mail in mails]))
+        results['send_many'] = result(count, best_of(options.repeat,
+                    lambda: testmailclient.send_many(url, mails)))
+        results['send_file'] = result(count, best_of(options.repeat, lambda: [
+                    testmailclient.send_file(url, mailpath) for mail in mails]))
+        return results
+    finally:
+        server.stop()
+
+def _lock_worker(backend, lockfile, rounds):
+    for i in range(rounds):
+        lock = smtp2zope.make_lock(lockfile, backend)
+        lock.lock(60)
+        lock.unlock()
+
+@benchmark
+def lock_contention(options, tmpdir):
+    results = {}
+    workers = options.lock_workers
+    for backend in sorted(smtp2zope.LOCK_BACKENDS):
+        # The hard-link lock sleeps up to two seconds when it loses a
+        # race, so give it far fewer rounds.
+        rounds = backend == 'link' and 3 or options.lock_rounds
+        lockfile = os.path.join(tmpdir, '%s.lock' % backend)
+        if backend == 'thread':
+            start = lambda: threading.Thread(target=_lock_worker,
+                                             args=(backend, lockfile, rounds))
+        else:
+            start = lambda: multiprocessing.Process(target=_lock_worker,
+                                                    args=(backend, lockfile, rounds))
+        def run():
+            runners = [start() for i in range(workers)]
+            for runner in runners:
+                runner.start()
+            for runner in runners:
+                runner.join()
+        results['lock.%s' % backend] = result(
+            workers * rounds, best_of(options.repeat, run), workers=workers)
+    return results
+
+@benchmark
+def send_scopes(options, tmpdir):
+    # Threads sending to different lists of a receiver that takes a
+    # while to answer, under each way of scoping the send lock.
+    server = MailReceiver(os.path.join(tmpdir, 'scoped'), delay=0.005).start()
+    try:
+        workers = options.lock_workers
+        urls = [server.url + 'lists/bench%d/manage_mailboxer' % i
+                for i in range(workers)]
+        mail = synthetic_mail(0)
+        rounds = 20
+        results = {}
+        for scope, slots in (('global', 1), ('global', workers),
+                             ('url', 1), ('off', 1)):
+            def worker(url):
+                for i in range(rounds):
+                    smtp2zope.send(url, mail, lock_backend='thread',
+                                   lock_scope=scope, lock_slots=slots)
+            def run():
+                threads = [threading.Thread(target=worker, args=(url,))
+                           for url in urls]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            results['send_scope.%s.%d' % (scope, slots)] = result(
+                workers * rounds, best_of(options.repeat, run),
+                workers=workers)
+        return results
+    finally:
+        server.stop()
+
+@benchmark
+def select(options, tmpdir):
+    results = {}
+    for size in options.sizes:
+        spool = os.path.join(tmpdir, 'select-%d' % size)
+        write_spool(spool, size)
+        last = 'Message %d' % (size - 1)
+        def cold():
+            fresh_state(spool)
+            testmailclient.select_mail_from_header('Subject', last)
+        def warm():
+            for i in range(100):
+                testmailclient.select_mail_from_header('Subject', last)
+        results['select.cold.%d' % size] = result(
+            1, best_of(options.repeat, cold), mails=size)
+        results['select.warm.%d' % size] = result(
+            100, best_of(options.repeat, warm), mails=size)
+    return results
+
+@benchmark
+def mbox(options, tmpdir):
+    from testmailclient.mbox import MboxSource
+    results = {}
+    for size in options.sizes:
+        path = os.path.join(tmpdir, 'select-%d.mbox' % size)
+        fp = open(path, 'wb')
+        for number in range(size):
+            fp.write('From list-owner@lists.example.org Thu Jan  1 00:00:00 2009\n')
+            fp.write(synthetic_mail(number))
+            fp.write('\n')
+        fp.close()
+        last = 'Message %d' % (size - 1)
+        def cold():
+            testmailclient._mail_source = MboxSource(path)
+            testmailclient.clear_mail_cache()
+            testmailclient.select_mail_from_header('Subject', last)
+            testmailclient.mail_contains('Please confirm')
+        results['mbox.cold.%d' % size] = result(
+            1, best_of(options.repeat, cold), mails=size)
+    return results
+
+@benchmark
+def mail_contains(options, tmpdir):
+    results = {}
+    for attachment_size in (0, options.attachment_size):
+        spool = os.path.join(tmpdir, 'contains-%d' % attachment_size)
+        write_spool(spool, 10, attachment_size)
+        def run():
+            fresh_state(spool)
+            testmailclient.select_mail_from_header('Subject', 'Message 9')
+            for i in range(20):
+                testmailclient.mail_contains('Please confirm')
+                testmailclient.mail_has_header('To', 'member9@example.org')
+        results['mail_contains.attachment-%d' % attachment_size] = result(
+            40, best_of(options.repeat, run), attachment_size=attachment_size)
+    return results
+
+@benchmark
+def links(options, tmpdir):
+    results = {}
+    for size in options.sizes:
+        spool = os.path.join(tmpdir, 'links-%d' % size)
+        mailpaths = write_spool(spool, size)
+        def run():
+            for mailpath in mailpaths:
+                read_mail(mailpath).links()
+        results['links.%d' % size] = result(
+            size, best_of(options.repeat, run), mails=size)
+    return results
+
+def _write_fanout(spool, count, attachment_size=0):
+    """Write count copies of one list posting, as sent to count
+    subscribers: only the To header differs."""
+    os.makedirs(spool)
+    posting = synthetic_mail(0, attachment_size)
+    for number in range(count):
+        fp = open(os.path.join(spool, 'mail-%06d.eml' % number), 'wb')
+        fp.write(posting.replace('To: member0@',
+                                 'To: member%d@' % number, 1))
+        fp.close()
+
+@benchmark
+def fanout(options, tmpdir):
+    """each_mail_contains and link extraction across a spool of one
+    posting fanned out to every subscriber, against distinct mails."""
+    results = {}
+    for size in options.sizes:
+        for kind in ('distinct', 'fanout'):
+            spool = os.path.join(tmpdir, '%s-%d' % (kind, size))
+            if kind == 'fanout':
+                _write_fanout(spool, size, 16 * 1024)
+            else:
+                write_spool(spool, size, 16 * 1024)
+            def run():
+                fresh_state(spool)
+                testmailclient.each_mail_contains('Please confirm',
+                                                  'To unsubscribe')
+                for mailpath in testmailclient.get_mail():
+                    testmailclient.get_message(mailpath).links()
+            results['fanout.%s-%d' % (kind, size)] = result(
+                size, best_of(options.repeat, run), mails=size)
+    return results
+
+def _parse_whole(mailString):
+    # What stripping used to cost: the whole mail parsed into a Message.
+    import email
+    msg = email.message_from_string(mailString)
+    for part in msg.walk():
+        if part.get_content_type() == 'text/plain':
+            return part.get_payload()
+
+@benchmark
+def strip(options, tmpdir):
+    from cStringIO import StringIO
+    from testmailclient.strip import strip_attachments
+    results = {}
+    for attachment_size in (64 * 1024, options.attachment_size):
+        mailString = synthetic_mail(0, attachment_size)
+        mailpath = os.path.join(tmpdir, 'strip-%d.eml' % attachment_size)
+        fp = open(mailpath, 'wb')
+        fp.write(mailString)
+        fp.close()
+        def from_file():
+            fp = open(mailpath, 'rb')
+            strip_attachments(fp)
+            fp.close()
+        results['strip.file.%d' % attachment_size] = result(
+            1, best_of(options.repeat, from_file),
+            attachment_size=attachment_size)
+        results['strip.string.%d' % attachment_size] = result(
+            1, best_of(options.repeat,
+                       lambda: strip_attachments(StringIO(mailString))),
+            attachment_size=attachment_size)
+        results['strip.parse_whole.%d' % attachment_size] = result(
+            1, best_of(options.repeat, lambda: _parse_whole(mailString)),
+            attachment_size=attachment_size)
+    return results
+
+@benchmark
+def check_links(options, tmpdir):
+    # The links in the synthetic mails, pointed at a local receiver
+    # that takes a few milliseconds to answer each GET.
+    from testmailclient.linkcheck import LinkChecker
+    server = MailReceiver(os.path.join(tmpdir, 'links-server'),
+                          delay=0.005).start()
+    try:
+        links = []
+        for number in range(options.link_count // 2):
+            mailpath = os.path.join(tmpdir, 'links-%d.eml' % number)
+            fp = open(mailpath, 'wb')
+            fp.write(synthetic_mail(number).replace(
+                    'http://lists.example.org/', server.url).replace(
+                    'https://lists.example.org/', server.url))
+            fp.close()
+            links.extend(read_mail(mailpath).links())
+        results = {}
+        for concurrency in (1, 8):
+            checker = LinkChecker(concurrency)
+            def run():
+                for link in checker.check(links):
+                    assert link.ok, link
+            results['check_links.%d' % concurrency] = result(
+                len(links), best_of(options.repeat, run),
+                concurrency=concurrency)
+        return results
+    finally:
+        server.stop()
+
+def _session_user(url, outgoing, mails, errors):
+    """One simulated user: send mails with its own browser, then find
+    and check each of them through its own cookie."""
+    try:
+        with MailSession():
+            testmailclient.send_mails(outgoing, url)
+            testmailclient.num_mails(len(mails))
+            for recipient in mails:
+                testmailclient.select_mail_from_header('To', recipient)
+                testmailclient.mail_contains(recipient)
+                testmailclient.num_mail_links(2)
+    except Exception, e:
+        errors.append(e)
+
+@benchmark
+def sessions(options, tmpdir):
+    """Simulated users, each in a MailSession, sending and checking
+    mail from threads of one process -- against the same users one
+    after another."""
+    server = MailReceiver(os.path.join(tmpdir, 'sessions'), delay=0.005).start()
+    scope, smtp2zope.LOCK_SCOPE = smtp2zope.LOCK_SCOPE, 'url'
+    try:
+        users = options.session_users
+        per_user = options.session_mails
+        work = []
+        for user in range(users):
+            outgoing = os.path.join(tmpdir, 'session-%d' % user)
+            os.makedirs(outgoing)
+            mails = []
+            for number in range(per_user):
+                recipient = 'user%d-%d@example.org' % (user, number)
+                fp = open(os.path.join(outgoing, '%d.eml' % number), 'wb')
+                fp.write(synthetic_mail(number, recipient=recipient))
+                fp.close()
+                mails.append(recipient)
+            # Each user posts to a list of their own, so with the send
+            # lock scoped per URL their sends don't wait on each other.
+            url = server.url + 'lists/user%d/manage_mailboxer' % user
+            work.append((url, outgoing, mails))
+        results = {}
+        for mode in ('serial', 'threads'):
+            def run():
+                errors = []
+                if mode == 'serial':
+                    for args in work:
+                        _session_user(*(args + (errors,)))
+                else:
+                    threads = [threading.Thread(target=_session_user,
+                                                args=args + (errors,))
+                               for args in work]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                if errors:
+                    raise errors[0]
+            results['sessions.%s.%d' % (mode, users)] = result(
+                users * per_user, best_of(options.repeat, run), users=users)
+        return results
+    finally:
+        smtp2zope.LOCK_SCOPE = scope
+        server.stop()
+
+def compare(results, baseline):
+    print
+    print '%-36s %12s %12s %8s' % ('benchmark', 'baseline s', 'now s', 'speedup')
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['seconds'], results[name]['seconds']
+        print '%-36s %12.4f %12.4f %7.2fx' % (name, old, new, new and old / new or 0)
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default='10,100,1000',
+                      help='comma-separated spool sizes')
+    parser.add_option('--full', action='store_true',
+                      help='also run the 10000-mail spools')
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--send-count', type='int', default=200)
+    parser.add_option('--lock-workers', type='int', default=4)
+    parser.add_option('--lock-rounds', type='int', default=200)
+    parser.add_option('--link-count', type='int', default=200)
+    parser.add_option('--session-users', type='int', default=20)
+    parser.add_option('--session-mails', type='int', default=5)
+    parser.add_option('--attachment-size', type='int', default=4 * 1024 * 1024)
+    parser.add_option('--only', action='append',
+                      help='run only this benchmark (repeatable)')
+    parser.add_option('--output', default='bench-results.json')
+    parser.add_option('--compare', help='earlier results to compare with')
+    options, args = parser.parse_args(argv)
+    options.sizes = [int(size) for size in options.sizes.split(',')]
+    if options.full and 10000 not in options.sizes:
+        options.sizes.append(10000)
+
+    results = {}
+    tmpdir = tempfile.mkdtemp(prefix='testmailclient-bench-')
+    try:
+        for bench in BENCHMARKS:
+            if options.only and bench.__name__ not in options.only:
+                continue
+            print >> sys.stderr, 'running %s...' % bench.__name__
+            results.update(bench(options, tmpdir))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    for name in sorted(results):
+        row = results[name]
+        print '%-36s %10.4fs %12.1f ops/s' % (name, row['seconds'],
+                                             row['ops_per_sec'] or 0)
+    report = {'python': sys.version.split()[0],
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': results}
+    fp = open(options.output, 'w')
+    json.dump(report, fp, indent=2, sort_keys=True)
+    fp.close()
+    if options.compare:
+        fp = open(options.compare)
+        compare(results, json.load(fp)['results'])
+        fp.close()
+
+if __name__ == '__main__':
+    main()
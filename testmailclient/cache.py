@@ -0,0 +1,185 @@
+"""
+A small LRU cache of parsed mails, shared by all the mail commands.
+
+A selected mail typically gets asserted against many times in a row,
+so rather than reparsing the file for every command we keep the parsed
+result around, keyed by the file's path, mtime and size.  If the file
+changes on disk its key changes too, and the stale entry is replaced
+on the next lookup.
+
+Both caches here lock their bookkeeping, so threads may share them;
+loading a mail happens outside the lock.
+"""
+
+import threading
+from collections import OrderedDict
+
+from testmailclient.mbox import stat_mail
+
+# Approximate upper bound, in bytes, on the mails held in the cache.
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+class MailCache(object):
+    """LRU cache mapping mail paths to whatever ``loader`` makes of them.
+
+    The cost of an entry is the size of the mail file, which is a
+    reasonable stand-in for the memory a parsed message takes up.
+    Entries are evicted least-recently-used first once the total
+    cost goes over ``max_bytes``.
+    """
+
+    def __init__(self, loader, max_bytes=DEFAULT_MAX_BYTES):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        size, mtime = stat_mail(path)
+        key = (mtime, size)
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                if entry[0] == key:
+                    self.hits += 1
+                    self._entries[path] = entry
+                    return entry[1]
+                # The file changed underneath us; forget the old parse.
+                self._bytes -= entry[2]
+            self.misses += 1
+        finally:
+            self._lock.release()
+        value = self.loader(path)
+        cost = size
+        if cost <= self.max_bytes:
+            self._lock.acquire()
+            try:
+                # Another thread may have loaded it meanwhile.
+                entry = self._entries.pop(path, None)
+                if entry is not None:
+                    self._bytes -= entry[2]
+                self._entries[path] = (key, value, cost)
+                self._bytes += cost
+                self._evict()
+            finally:
+                self._lock.release()
+        return value
+
+    def set_max_bytes(self, max_bytes):
+        self._lock.acquire()
+        try:
+            self.max_bytes = max_bytes
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def invalidate(self, path=None):
+        """Drop ``path`` from the cache, or everything if no path is given."""
+        self._lock.acquire()
+        try:
+            if path is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        self._lock.acquire()
+        try:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'max_bytes': self.max_bytes}
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry[2]
+            self.evictions += 1
+
+class BodyCache(object):
+    """LRU table of what has been worked out from a mail body, shared
+    by every mail with the same body.
+
+    A list posting fans out to each subscriber as a separate mail that
+    differs only in its To header, so rather than decoding the MIME
+    structure and extracting links once per recipient, MailRecord looks
+    them up here by ``body_key()``.  Each entry is a dict that callers
+    fill in as they go.  Costs and eviction work as for MailCache.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def entry(self, key, cost):
+        """Return the dict for the body with digest key, making an empty
+        one if it isn't known yet."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.hits += 1
+                self._entries[key] = entry
+                return entry[1]
+            self.misses += 1
+            value = {}
+            if cost <= self.max_bytes:
+                self._entries[key] = (cost, value)
+                self._bytes += cost
+                self._evict()
+            return value
+        finally:
+            self._lock.release()
+
+    def set_max_bytes(self, max_bytes):
+        self._lock.acquire()
+        try:
+            self.max_bytes = max_bytes
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        self._lock.acquire()
+        try:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'max_bytes': self.max_bytes}
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry[0]
+            self.evictions += 1
@@ -0,0 +1,190 @@
+"""
+A persistent mail index shared between processes.
+
+When a suite is sharded across several twill processes on one host,
+each of them would otherwise read the same spool files to build its
+own HeaderIndex, and nothing would be kept from one run to the next.
+MailDatabase keeps the same information in an SQLite database, in WAL
+mode so that readers never block behind a writer: each mail's path,
+size, mtime and SHA-1, and its headers.  A mail is only read if no
+process has indexed it yet, or if it has changed since.
+
+It has the same interface as HeaderIndex, so select_mail_from_header
+can use either; see use_mail_index.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+from testmailclient.mbox import split_member, stat_mail
+from testmailclient.reader import read_mail
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS mails (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha1 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS headers (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS headers_by_value ON headers (name, value);
+CREATE UNIQUE INDEX IF NOT EXISTS headers_by_path ON headers (path, name);
+'''
+
+# SQLite's default limit on the number of ?s in one statement is 999.
+_BATCH = 500
+
+def _batches(items):
+    for start in range(0, len(items), _BATCH):
+        yield items[start:start + _BATCH]
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    source, start, end = split_member(path)
+    fp = open(source, 'rb')
+    try:
+        remaining = None
+        if start is not None:
+            fp.seek(start)
+            remaining = end - start
+        while remaining is None or remaining > 0:
+            size = 64 * 1024
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            data = fp.read(size)
+            if not data:
+                break
+            digest.update(data)
+        return digest.hexdigest()
+    finally:
+        fp.close()
+
+class MailDatabase(object):
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # path -> (size, mtime) already known to be indexed
+        self._seen = {}
+        self._create_schema()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         isolation_level=None)
+            connection.text_factory = str
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self):
+        # Several processes may open a new database at once.  Creating
+        # the schema in one of them makes the others' statements fail
+        # with "database schema has changed", which the busy timeout
+        # doesn't cover, so retry until the timeout runs out.
+        connection = self._connection()
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    for statement in SCHEMA.split(';'):
+                        if statement.strip():
+                            connection.execute(statement)
+                except:
+                    connection.execute('ROLLBACK')
+                    raise
+                connection.execute('COMMIT')
+                return
+            except sqlite3.OperationalError, e:
+                message = str(e)
+                if ('locked' not in message and 'busy' not in message
+                    and 'schema has changed' not in message):
+                    raise
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def update(self, mailpaths):
+        """Index any of mailpaths that no process has indexed yet, or
+        that have changed since they were."""
+        stale = {}
+        for mailpath in mailpaths:
+            try:
+                key = stat_mail(mailpath)
+            except OSError:
+                continue
+            if self._seen.get(mailpath) != key:
+                stale[mailpath] = key
+        if not stale:
+            return
+        connection = self._connection()
+        for batch in _batches(stale.keys()):
+            rows = connection.execute(
+                'SELECT path, size, mtime FROM mails WHERE path IN (%s)'
+                % ','.join('?' * len(batch)), batch)
+            for mailpath, size, mtime in rows:
+                if stale[mailpath] == (size, mtime):
+                    self._seen[mailpath] = stale.pop(mailpath)
+        if not stale:
+            return
+        # Read the files before taking the write lock.
+        entries = []
+        for mailpath, (size, mtime) in stale.items():
+            record = read_mail(mailpath)
+            # Like Message.get, only the first occurrence of a header counts.
+            items = {}
+            for name, value in record.items():
+                items.setdefault(name.lower(), value)
+            entries.append((mailpath, size, mtime, file_sha1(mailpath),
+                            items.items()))
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for mailpath, size, mtime, sha1, items in entries:
+                connection.execute('DELETE FROM headers WHERE path = ?',
+                                   (mailpath,))
+                connection.execute(
+                    'INSERT OR REPLACE INTO mails VALUES (?, ?, ?, ?)',
+                    (mailpath, size, mtime, sha1))
+                connection.executemany(
+                    'INSERT INTO headers VALUES (?, ?, ?)',
+                    [(mailpath, name, value) for name, value in items])
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        for mailpath, size, mtime, sha1, items in entries:
+            self._seen[mailpath] = (size, mtime)
+
+    def lookup(self, header, value):
+        """Return the indexed paths with a header of exactly this value."""
+        rows = self._connection().execute(
+            'SELECT path FROM headers WHERE name = ? AND value = ?',
+            (header.lower(), value))
+        return [row[0] for row in rows]
+
+    def value(self, mailpath, header):
+        """Return the indexed value of header for mailpath, or None."""
+        row = self._connection().execute(
+            'SELECT value FROM headers WHERE path = ? AND name = ?',
+            (mailpath, header.lower())).fetchone()
+        return row and row[0]
+
+    def sha1(self, mailpath):
+        row = self._connection().execute(
+            'SELECT sha1 FROM mails WHERE path = ?', (mailpath,)).fetchone()
+        return row and row[0]
+
+    def clear(self):
+        """Forget what this process knows; the shared index is kept."""
+        self._seen.clear()
@@ -0,0 +1,194 @@
+"""
+Batched, asynchronous MailBoxer event notification.
+
+eventNotification used to make a new ServerProxy and wait for
+manage_event on every call, while the send lock was still held.  Now
+events are queued, and a background thread delivers them a short
+while later: all the events for one MailBoxer go in a single
+system.multicall request (one at a time if the server doesn't support
+that), over a kept-alive connection per MailBoxer.  Anything still
+queued is delivered at exit, and flush() delivers it at once.
+"""
+
+import atexit
+import re
+import sys
+import threading
+import time
+import xmlrpclib
+
+# How long to wait for more events before delivering a batch, in seconds
+BATCH_DELAY = 0.05
+
+# Socket timeout for notification requests, in seconds
+TIMEOUT = 30
+
+_end_of_headers = re.compile(r'\r?\n\r?\n')
+
+def mail_headers(mailString):
+    """The header block of mailString, as manage_event expects it."""
+    return _end_of_headers.split(mailString, 1)[0]
+
+class _TimeoutMixin:
+    timeout = None
+
+    def make_connection(self, host):
+        # Transport keeps this connection alive between requests.
+        connection = self._base.make_connection(self, host)
+        if self.timeout is not None:
+            connection.timeout = self.timeout
+        return connection
+
+class Transport(_TimeoutMixin, xmlrpclib.Transport):
+    _base = xmlrpclib.Transport
+
+class SafeTransport(_TimeoutMixin, xmlrpclib.SafeTransport):
+    _base = xmlrpclib.SafeTransport
+
+def _log_error(msg):
+    sys.stderr.write(msg + "\n")
+
+class EventQueue(object):
+
+    def __init__(self, delay=BATCH_DELAY, timeout=TIMEOUT, log_error=None):
+        self.delay = delay
+        self.timeout = timeout
+        self.log_error = log_error or _log_error
+        # baseURL -> [(event_codes, headers)], and the order the URLs
+        # were first seen in
+        self._pending = {}
+        self._order = []
+        self._proxies = {}
+        self._no_multicall = set()
+        self._condition = threading.Condition()
+        # Held while delivering, so that flush() waits for a batch the
+        # background thread has already taken.
+        self._delivering = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.sent = 0
+        self.failed = 0
+
+    def notify(self, url, event_codes, headers):
+        self._condition.acquire()
+        try:
+            if url not in self._pending:
+                self._pending[url] = []
+                self._order.append(url)
+            self._pending[url].append((tuple(event_codes), headers))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+                atexit.register(self.close)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def _take(self):
+        batches = [(url, self._pending[url]) for url in self._order]
+        self._pending = {}
+        self._order = []
+        return batches
+
+    def _run(self):
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._order and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            finally:
+                self._condition.release()
+            # Let more events gather into this batch.
+            time.sleep(self.delay)
+            self._flush()
+
+    def _flush(self):
+        self._delivering.acquire()
+        try:
+            self._condition.acquire()
+            try:
+                batches = self._take()
+            finally:
+                self._condition.release()
+            for url, events in batches:
+                try:
+                    self._deliver(url, events)
+                except Exception, e:
+                    self.failed += len(events)
+                    self.log_error('Notifying %s of %d events failed: %s' % (
+                            url, len(events), e))
+                else:
+                    self.sent += len(events)
+        finally:
+            self._delivering.release()
+
+    def flush(self):
+        """Deliver every queued event before returning."""
+        self._flush()
+
+    def close(self):
+        """Stop the background thread, then deliver what is left."""
+        self._condition.acquire()
+        try:
+            self._closed = True
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        if self._thread is not None:
+            self._thread.join()
+        self._flush()
+
+    def _proxy(self, url):
+        proxy = self._proxies.get(url)
+        if proxy is None:
+            if url.startswith('https:'):
+                transport = SafeTransport()
+            else:
+                transport = Transport()
+            transport.timeout = self.timeout
+            proxy = xmlrpclib.ServerProxy(url, transport)
+            self._proxies[url] = proxy
+        return proxy
+
+    def _deliver(self, url, events):
+        proxy = self._proxy(url)
+        if len(events) > 1 and url not in self._no_multicall:
+            multicall = xmlrpclib.MultiCall(proxy)
+            for event_codes, headers in events:
+                multicall.manage_event(event_codes, headers)
+            try:
+                results = multicall()
+            except (xmlrpclib.Fault, xmlrpclib.ProtocolError):
+                # Zope doesn't provide system.multicall.
+                self._no_multicall.add(url)
+            else:
+                # Raises the first Fault among the results.
+                list(results)
+                return
+        for event_codes, headers in events:
+            proxy.manage_event(event_codes, headers)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue(log_error=None):
+    global _queue
+    _queue_lock.acquire()
+    try:
+        if _queue is None:
+            _queue = EventQueue(log_error=log_error)
+        return _queue
+    finally:
+        _queue_lock.release()
+
+def notify(url, event_codes, mailString, log_error=None):
+    """Queue a manage_event call on the MailBoxer at url."""
+    get_queue(log_error).notify(url, event_codes, mail_headers(mailString))
+
+def flush():
+    """Deliver any queued events now."""
+    if _queue is not None:
+        _queue.flush()
@@ -0,0 +1,64 @@
+"""
+Checking a batch of expectations against a mail in one go.
+
+Each expectation is a string in one of these forms:
+
+  Header=value       the header has exactly this value
+  contains:text      the mail's text contains text
+  lacks:text         the mail's text does not contain text
+  matches:regex      the mail's text matches the regular expression
+
+They're compiled once into a checker that looks at each mail's headers
+and makes a single pass over its text for all the body expectations
+together, collecting every failure rather than stopping at the first.
+"""
+
+from testmailclient.search import MultiSearch, mail_text
+
+class Expectations(object):
+
+    def __init__(self, specs):
+        self.headers = []
+        literals = []   # (needle, should be found)
+        patterns = []
+        for spec in specs:
+            if spec.startswith('contains:'):
+                literals.append((spec[len('contains:'):], True))
+            elif spec.startswith('lacks:'):
+                literals.append((spec[len('lacks:'):], False))
+            elif spec.startswith('matches:'):
+                patterns.append(spec[len('matches:'):])
+            elif '=' in spec:
+                self.headers.append(tuple(spec.split('=', 1)))
+            else:
+                raise ValueError("Don't know how to check <%s>; expected "
+                                 "Header=value, contains:, lacks: or "
+                                 "matches:" % spec)
+        self.literals = literals
+        self.patterns = patterns
+        self._literals = MultiSearch([needle for needle, _ in literals])
+        self._patterns = MultiSearch(patterns, regex=True)
+
+    def check(self, record):
+        """Return a list of failure messages for record; empty if every
+        expectation holds."""
+        failures = []
+        for header, value in self.headers:
+            actual = record.get(header)
+            if actual != value:
+                failures.append("expected header %s=%s; got %s" % (
+                        header, value, actual))
+        if not (self.literals or self.patterns):
+            return failures
+        text = mail_text(record)
+        found = self._literals.search(text)
+        for (needle, wanted), hit in zip(self.literals, found):
+            if wanted and not hit:
+                failures.append("no match for <%s>" % needle)
+            elif hit and not wanted:
+                failures.append("unexpected match for <%s>" % needle)
+        found = self._patterns.search(text)
+        for pattern, hit in zip(self.patterns, found):
+            if not hit:
+                failures.append("no match for regex <%s>" % pattern)
+        return failures
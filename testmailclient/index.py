@@ -0,0 +1,83 @@
+"""
+An incremental index of mail headers.
+
+select_mail_from_header used to parse every mail in get_mail() each
+time it was called.  Instead we read just the header block of each
+mail the first time we see its path, and keep a mapping of
+
+  header name -> header value -> [mail paths]
+
+so that later selects are dictionary lookups.  New paths showing up in
+the cookie are indexed as they appear, and a mail whose size or mtime
+has changed since it was indexed -- one that was still being written,
+say -- is indexed again.
+"""
+
+import threading
+
+from testmailclient.mbox import stat_mail
+from testmailclient.reader import read_mail
+
+class HeaderIndex(object):
+
+    def __init__(self, reader=read_mail):
+        self.reader = reader
+        # header name -> value -> [paths], in the order paths were indexed
+        self._index = {}
+        # header name -> path -> value
+        self._values = {}
+        # path -> (size, mtime) when it was indexed
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def update(self, mailpaths):
+        """Index any of mailpaths that haven't been indexed yet, or that
+        have changed since they were."""
+        for mailpath in mailpaths:
+            try:
+                key = stat_mail(mailpath)
+            except OSError:
+                continue
+            if self._seen.get(mailpath) == key:
+                continue
+            self.add(mailpath, self.reader(mailpath), key)
+
+    def add(self, mailpath, msg, key=None):
+        self._lock.acquire()
+        try:
+            # Another thread may have indexed it since update() looked.
+            if mailpath in self._seen:
+                if key is not None and self._seen[mailpath] == key:
+                    return
+                self._remove(mailpath)
+            self._seen[mailpath] = key
+            for name in set(key.lower() for key in msg.keys()):
+                # Like Message.get, only the first occurrence counts.
+                value = msg.get(name)
+                self._values.setdefault(name, {})[mailpath] = value
+                self._index.setdefault(name, {}).setdefault(value, []).append(mailpath)
+        finally:
+            self._lock.release()
+
+    def _remove(self, mailpath):
+        for name, values in self._values.items():
+            if mailpath in values:
+                paths = self._index[name][values.pop(mailpath)]
+                paths.remove(mailpath)
+
+    def lookup(self, header, value):
+        """Return the indexed paths whose header has exactly this value."""
+        return self._index.get(header.lower(), {}).get(value, [])
+
+    def value(self, mailpath, header):
+        """Return the indexed value of header for mailpath, or None."""
+        return self._values.get(header.lower(), {}).get(mailpath)
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._index.clear()
+            self._values.clear()
+            self._seen.clear()
+        finally:
+            self._lock.release()
@@ -0,0 +1,110 @@
+"""
+Fetch many links at once, to check that they all work.
+
+click_link_in_mail follows one link at a time through the twill
+browser.  LinkChecker instead fetches a list of URLs from a bounded
+pool of worker threads.  Each worker keeps one kept-alive HTTP/1.1
+connection per host, so links to the same site share a connection, and
+reports the status and time taken for each link.  Redirects are
+reported, not followed.  The browser's cookies are not sent.
+"""
+
+import httplib
+import socket
+import threading
+import time
+import urlparse
+from Queue import Queue, Empty
+
+from testmailclient.stats import stats
+
+class LinkResult(object):
+
+    def __init__(self, url, status=None, seconds=None, error=None,
+                 location=None):
+        self.url = url
+        self.status = status
+        self.seconds = seconds
+        self.error = error
+        self.location = location
+
+    @property
+    def ok(self):
+        return self.error is None and self.status < 400
+
+    def __repr__(self):
+        return '<LinkResult %s %s>' % (self.status or self.error, self.url)
+
+class LinkChecker(object):
+
+    def __init__(self, concurrency=8, timeout=10, method='GET'):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.method = method
+
+    def check(self, urls):
+        """Fetch each of urls, returning a LinkResult for each, in the
+        same order."""
+        results = [None] * len(urls)
+        todo = Queue()
+        for index, url in enumerate(urls):
+            todo.put((index, url))
+        workers = [threading.Thread(target=self._work, args=(todo, results))
+                   for i in range(max(1, min(self.concurrency, len(urls))))]
+        for worker in workers:
+            worker.setDaemon(True)
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def _work(self, todo, results):
+        connections = {}
+        try:
+            while True:
+                try:
+                    index, url = todo.get_nowait()
+                except Empty:
+                    return
+                results[index] = self._fetch(url, connections)
+        finally:
+            for connection in connections.values():
+                connection.close()
+
+    def _fetch(self, url, connections):
+        parts = urlparse.urlsplit(url)
+        if parts[0] not in ('http', 'https'):
+            return LinkResult(url, error='not an http(s) URL')
+        key = parts[:2]
+        selector = urlparse.urlunsplit(('', '') + parts[2:4] + ('',)) or '/'
+        started = time.time()
+        # A kept-alive connection may have been closed by the server
+        # since we last used it, so retry once on a fresh one.
+        for attempt in (0, 1):
+            connection = connections.get(key)
+            fresh = connection is None
+            if fresh:
+                if parts[0] == 'https':
+                    factory = httplib.HTTPSConnection
+                else:
+                    factory = httplib.HTTPConnection
+                connection = connections[key] = factory(
+                    parts[1], timeout=self.timeout)
+            try:
+                connection.request(self.method, selector)
+                response = connection.getresponse()
+                response.read()
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                del connections[key]
+                if fresh:
+                    return LinkResult(url, seconds=time.time() - started,
+                                      error=str(e) or e.__class__.__name__)
+                continue
+            if response.will_close:
+                connection.close()
+                del connections[key]
+            seconds = time.time() - started
+            stats.record('LinkChecker.fetch', seconds)
+            return LinkResult(url, response.status, seconds,
+                              location=response.getheader('location'))
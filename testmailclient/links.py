@@ -0,0 +1,57 @@
+"""
+Finding the links in a mail.
+
+Links are looked for in the decoded text of every text/* part, so
+quoted-printable and base64 encoded parts work, as do https links and
+URLs that were wrapped over several lines, either inside <angle
+brackets> or by format=flowed soft line breaks.  A single compiled
+pattern finds them all in one pass over each part.
+"""
+
+import re
+
+_url = re.compile(r'<\s*(https?://[^>]+)>|(https?://[^\s<>"\'`]+)', re.I)
+_whitespace = re.compile(r'\s+')
+_flowed_break = re.compile(r' \r?\n(?!-- ?\r?\n)')
+
+def _unflow(text, delsp=False):
+    # RFC 3676: a line ending in a space continues on the next line.
+    # With DelSp=yes that space was only added to mark the break, which
+    # is how long words like URLs get wrapped.
+    if delsp:
+        return _flowed_break.sub('', text)
+    return _flowed_break.sub(' ', text)
+
+def _clean(url):
+    # Punctuation closing a sentence isn't part of the link, and neither
+    # is a closing parenthesis that has no opening one in the URL.
+    url = url.rstrip('.,;:!?\'"')
+    while url.endswith(')') and url.count('(') < url.count(')'):
+        url = url[:-1].rstrip('.,;:!?\'"')
+    return url
+
+def find_links(text, html=False):
+    """Return the URLs in text, in order."""
+    links = []
+    for match in _url.finditer(text):
+        bracketed, bare = match.groups()
+        if bracketed is not None:
+            url = _whitespace.sub('', bracketed)
+        else:
+            url = _clean(bare)
+        if html:
+            url = url.replace('&amp;', '&')
+        links.append(url)
+    return links
+
+def extract_links(parts):
+    """Return the URLs in a list of parts as returned by
+    MailRecord.text_parts, in order.  A URL appearing more than once
+    is listed each time, so links keep the numbers click_link_in_mail
+    has always given them."""
+    links = []
+    for content_type, text, flowed in parts:
+        if flowed:
+            text = _unflow(text, flowed == 'delsp')
+        links.extend(find_links(text, html=content_type == 'text/html'))
+    return links
@@ -0,0 +1,491 @@
+"""
+A long-running SMTP/LMTP front end for the smtp2zope sender.
+
+Run from an MTA alias, smtp2zope starts a new Python for every mail,
+and pays for the imports, a fresh HTTP connection and its exit code
+each time.  MailListener accepts mail over SMTP (or LMTP) on a local
+socket instead and forwards each one through the same send(), with a
+pool of kept-alive MailPosters per receiver URL.  Where smtp2zope
+would have exited with an EXIT_ code, the client gets the matching
+reply:
+
+  sent                          250 2.0.0
+  no such list (EXIT_NOUSER)    550 5.1.1
+  too big (EXIT_NOPERM)         552 5.3.4
+  anything else (EXIT_TEMPFAIL) 451 4.3.0
+
+The receiver URL may contain {list}, which is replaced by the local
+part of each recipient, so one listener can serve every list:
+
+  python -m testmailclient.listener \\
+      'http://localhost:8080/lists/{list}/manage_mailboxer' --port 8025
+
+LMTP answers for each recipient, but SMTP has one reply per message,
+and failing a message that some lists already took would make the
+client send it to them again.  So over SMTP:
+
+  - a list found missing is remembered for MISSING_TTL seconds, and
+    recipients on it are turned away at RCPT, before anything is sent;
+  - a list that took a mail within the last EXISTING_TTL seconds is
+    known to exist.  A message may go to any number of known lists, or
+    to a single list that isn't known yet; other recipients get a
+    452, and the client sends them in a transaction of their own.  So
+    a list that doesn't exist fails its message alone, with a 550 the
+    client can bounce;
+  - once any recipient has the mail, the message is accepted and the
+    others are handed to an Outbox (see testmailclient.outbox) to
+    retry, which keeps what still fails for good in its failed/
+    directory.  The outbox is spooled in --outbox, or by default in a
+    directory named after the listener's address, which the next
+    listener on that address picks up again.
+"""
+
+import SocketServer
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from testmailclient import smtp2zope
+from testmailclient.outbox import Outbox
+
+# Replies for the exit codes smtp2zope would have ended with
+EXIT_REPLIES = {
+    0: '250 2.0.0 Ok',
+    smtp2zope.EXIT_NOUSER: '550 5.1.1 No such list',
+    smtp2zope.EXIT_NOPERM: '552 5.3.4 Message too big',
+    smtp2zope.EXIT_TEMPFAIL: '451 4.3.0 Temporary failure, try again later',
+    smtp2zope.EXIT_USAGE: '451 4.3.5 Listener misconfigured',
+    }
+
+# The longest command line we accept, as in RFC 5321
+MAX_LINE = 512
+
+# How long, in seconds, a list that didn't exist is rejected at RCPT
+MISSING_TTL = 60
+
+# How long, in seconds, a list that took a mail is known to exist
+EXISTING_TTL = 600
+
+# The default outbox of an SMTP listener is this, followed by its
+# host and port.
+OUTBOX_LOCATION = os.path.join(tempfile.gettempdir(), 'testmailclient-outbox')
+
+TOO_MANY_RECIPIENTS = '452 4.5.3 Too many recipients, send the rest separately'
+
+class PosterPool(object):
+    """Idle MailPosters, so that each receiver URL's connections are
+    kept alive between mails and never shared by two threads."""
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, callURL):
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(callURL)
+            if idle:
+                return idle.pop()
+        finally:
+            self._lock.release()
+        return smtp2zope.MailPoster(callURL)
+
+    def put(self, poster):
+        self._lock.acquire()
+        try:
+            self._idle.setdefault(poster.callURL, []).append(poster)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            for idle in self._idle.values():
+                for poster in idle:
+                    poster.close()
+            self._idle.clear()
+        finally:
+            self._lock.release()
+
+def deliver(callURL, mailString, maxBytes=None, poster=None, **kw):
+    """Send mailString through smtp2zope.send and return the reply an
+    SMTP client should get."""
+    try:
+        smtp2zope.send(callURL, mailString, maxBytes, poster=poster, **kw)
+    except SystemExit, e:
+        # send() exits, as smtp2zope would, when a mail is too big.
+        return EXIT_REPLIES.get(e.code, EXIT_REPLIES[smtp2zope.EXIT_TEMPFAIL])
+    except smtp2zope.SendError, e:
+        smtp2zope.log_error(str(e))
+        return EXIT_REPLIES[e.exit_code]
+    except Exception, e:
+        smtp2zope.log_error('Delivering to %s failed: %s' % (callURL, e))
+        return EXIT_REPLIES[smtp2zope.EXIT_TEMPFAIL]
+    return EXIT_REPLIES[0]
+
+def _address(argument):
+    # "FROM:<a@b> SIZE=12" -> "a@b"
+    value = argument.split(':', 1)[-1].strip()
+    if value.startswith('<'):
+        value = value[1:value.find('>')]
+    else:
+        value = (value.split() or [''])[0]
+    return value
+
+class MailListenerHandler(SocketServer.StreamRequestHandler):
+
+    disable_nagle_algorithm = True
+    timeout = 300
+
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+
+    def handle(self):
+        server = self.server
+        self.reply('220 %s %s testmailclient' % (
+                server.hostname, server.lmtp and 'LMTP' or 'ESMTP'))
+        self.reset()
+        while True:
+            line = self.rfile.readline(MAX_LINE + 1)
+            if not line:
+                return
+            if len(line) > MAX_LINE:
+                self.reply('500 5.5.6 Line too long')
+                # Skip the rest of it.
+                while line and not line.endswith('\n'):
+                    line = self.rfile.readline(MAX_LINE)
+                continue
+            parts = line.strip().split(None, 1)
+            if not parts:
+                self.reply('500 5.5.2 Syntax error')
+                continue
+            command = parts[0].upper()
+            argument = len(parts) > 1 and parts[1] or ''
+            method = getattr(self, 'smtp_' + command, None)
+            if method is None:
+                self.reply('502 5.5.1 Command not recognized')
+                continue
+            if method(argument) is False:
+                return
+
+    def reset(self):
+        self.sender = None
+        self.recipients = []
+        # The URL of the list not yet known to exist that this message
+        # goes to, if any
+        self.unverified = None
+
+    def greet(self, argument, lmtp):
+        server = self.server
+        if lmtp != server.lmtp:
+            self.reply('500 5.5.1 Use %s' % (server.lmtp and 'LHLO' or 'EHLO'))
+            return
+        self.reset()
+        lines = [server.hostname, 'PIPELINING', '8BITMIME',
+                 'ENHANCEDSTATUSCODES']
+        if server.maxBytes:
+            lines.append('SIZE %d' % server.maxBytes)
+        for line in lines[:-1]:
+            self.reply('250-' + line)
+        self.reply('250 ' + lines[-1])
+
+    def smtp_EHLO(self, argument):
+        self.greet(argument, False)
+
+    def smtp_LHLO(self, argument):
+        self.greet(argument, True)
+
+    def smtp_HELO(self, argument):
+        if self.server.lmtp:
+            return self.greet(argument, False)
+        self.reset()
+        self.reply('250 %s' % self.server.hostname)
+
+    def smtp_MAIL(self, argument):
+        if self.sender is not None:
+            return self.reply('503 5.5.1 Nested MAIL command')
+        if not argument.upper().startswith('FROM:'):
+            return self.reply('501 5.5.4 Syntax: MAIL FROM:<address>')
+        self.sender = _address(argument)
+        self.reply('250 2.1.0 Ok')
+
+    def smtp_RCPT(self, argument):
+        if self.sender is None:
+            return self.reply('503 5.5.1 Need MAIL command')
+        if not argument.upper().startswith('TO:'):
+            return self.reply('501 5.5.4 Syntax: RCPT TO:<address>')
+        recipient = _address(argument)
+        if not recipient:
+            return self.reply('501 5.1.3 Bad recipient address')
+        server = self.server
+        if server.is_missing(recipient):
+            return self.reply(EXIT_REPLIES[smtp2zope.EXIT_NOUSER])
+        if not server.lmtp:
+            callURL = server.url_for(recipient)
+            if callURL == self.unverified:
+                pass
+            elif self.unverified is not None:
+                return self.reply(TOO_MANY_RECIPIENTS)
+            elif not server.exists(recipient):
+                if self.recipients:
+                    return self.reply(TOO_MANY_RECIPIENTS)
+                self.unverified = callURL
+        self.recipients.append(recipient)
+        self.reply('250 2.1.5 Ok')
+
+    def smtp_DATA(self, argument):
+        if not self.recipients:
+            return self.reply('503 5.5.1 Need RCPT command')
+        self.reply('354 End data with <CR><LF>.<CR><LF>')
+        mailString, too_big = self.read_data()
+        if mailString is None:
+            return False
+        server = self.server
+        if too_big:
+            replies = [EXIT_REPLIES[smtp2zope.EXIT_NOPERM]] * len(self.recipients)
+        else:
+            replies = [server.deliver(recipient, mailString)
+                       for recipient in self.recipients]
+        if server.lmtp:
+            # LMTP answers for each recipient in turn.
+            for reply in replies:
+                self.reply(reply)
+        elif not [reply for reply in replies if reply.startswith('2')]:
+            # Nobody has it, so the client may safely retry (or bounce)
+            # the lot; a temporary failure means it should retry.
+            temporary = [reply for reply in replies if reply.startswith('4')]
+            self.reply((temporary or replies)[0])
+        else:
+            for recipient, reply in zip(self.recipients, replies):
+                if reply.startswith('2'):
+                    continue
+                if not reply.startswith('4'):
+                    # A known list that has gone since; the outbox
+                    # tries once more, then keeps it in failed/.
+                    smtp2zope.log_error('%s refused mail that other '
+                                        'recipients took: %s' % (
+                            recipient, reply))
+                server.defer(recipient, mailString)
+            self.reply(EXIT_REPLIES[0])
+        self.reset()
+
+    def read_data(self):
+        """Read the message up to the lone '.', undoing dot-stuffing.
+
+        Returns (mail, too_big); a mail over the listener's maxBytes is
+        read to the end but not kept.  mail is None if the client went
+        away first.
+        """
+        maxBytes = self.server.read_limit
+        lines = []
+        size = 0
+        too_big = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None, False
+            if line in ('.\r\n', '.\n'):
+                break
+            if line.startswith('.'):
+                line = line[1:]
+            # Mail from an MTA's pipe has bare newlines; keep to that.
+            if line.endswith('\r\n'):
+                line = line[:-2] + '\n'
+            size += len(line)
+            if maxBytes and size > maxBytes:
+                too_big = True
+                lines = []
+            if not too_big:
+                lines.append(line)
+        return ''.join(lines), too_big
+
+    def smtp_RSET(self, argument):
+        self.reset()
+        self.reply('250 2.0.0 Ok')
+
+    def smtp_NOOP(self, argument):
+        self.reply('250 2.0.0 Ok')
+
+    def smtp_VRFY(self, argument):
+        self.reply('252 2.5.0 Cannot verify, but will accept')
+
+    def smtp_QUIT(self, argument):
+        self.reply('221 2.0.0 Bye')
+        return False
+
+class MailListener(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """A threaded SMTP (or, with lmtp, LMTP) server forwarding each
+    mail to callURL through smtp2zope.send.
+
+    maxBytes limits the size of mails as in send(); any other keyword
+    arguments (lock_scope, strip_attachments...) are passed to send().
+    outbox is the spool directory of the Outbox that SMTP recipients
+    are retried from, by default OUTBOX_LOCATION followed by the
+    listener's host and port.  Mail left in it by an earlier listener
+    is delivered as soon as this one is made.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, callURL, host='127.0.0.1', port=0, lmtp=False,
+                 maxBytes=None, verbose=False, outbox=None, **send_options):
+        SocketServer.TCPServer.__init__(self, (host, port),
+                                        MailListenerHandler)
+        self.callURL = callURL
+        self.lmtp = lmtp
+        self.maxBytes = maxBytes and long(maxBytes) or None
+        # Stripping may bring a mail under maxBytes, so leave it to send().
+        self.read_limit = self.maxBytes
+        if send_options.get('strip_attachments'):
+            self.read_limit = None
+        self.verbose = verbose
+        self.send_options = send_options
+        self.hostname = socket.getfqdn()
+        self.posters = PosterPool()
+        self.delivered = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        # URL -> when it was found not to exist
+        self._missing = {}
+        # URL -> when it last took a mail
+        self._existing = {}
+        self.outbox = None
+        self.outbox_directory = outbox
+        if outbox is None and not lmtp:
+            self.outbox_directory = '%s-%s-%s' % ((OUTBOX_LOCATION,)
+                                                  + self.address)
+        if self.outbox_directory and os.path.isdir(self.outbox_directory):
+            # Pick up what an earlier listener left to retry.
+            self.outbox = self._make_outbox(self.outbox_directory)
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def url_for(self, recipient):
+        return self.callURL.replace('{list}', recipient.split('@')[0])
+
+    def deliver(self, recipient, mailString):
+        callURL = self.url_for(recipient)
+        poster = self.posters.get(callURL)
+        try:
+            reply = deliver(callURL, mailString, self.maxBytes, poster,
+                            **self.send_options)
+        finally:
+            self.posters.put(poster)
+        if self.verbose:
+            smtp2zope.log_info('%s -> %s: %s' % (recipient, callURL, reply))
+        self._lock.acquire()
+        try:
+            self.delivered += 1
+            if reply == EXIT_REPLIES[0]:
+                self._existing[callURL] = time.time()
+            elif reply == EXIT_REPLIES[smtp2zope.EXIT_NOUSER]:
+                self._missing[callURL] = time.time()
+                self._existing.pop(callURL, None)
+        finally:
+            self._lock.release()
+        return reply
+
+    def is_missing(self, recipient):
+        """Whether recipient's list was found not to exist within the
+        last MISSING_TTL seconds."""
+        callURL = self.url_for(recipient)
+        self._lock.acquire()
+        try:
+            found = self._missing.get(callURL)
+            if found is None:
+                return False
+            if time.time() - found > MISSING_TTL:
+                del self._missing[callURL]
+                return False
+            return True
+        finally:
+            self._lock.release()
+
+    def exists(self, recipient):
+        """Whether recipient's list took a mail within the last
+        EXISTING_TTL seconds."""
+        callURL = self.url_for(recipient)
+        self._lock.acquire()
+        try:
+            found = self._existing.get(callURL)
+            if found is None:
+                return False
+            if time.time() - found > EXISTING_TTL:
+                del self._existing[callURL]
+                return False
+            return True
+        finally:
+            self._lock.release()
+
+    def _make_outbox(self, directory):
+        options = dict(self.send_options)
+        options['maxBytes'] = self.maxBytes
+        return Outbox(directory, **options).start()
+
+    def defer(self, recipient, mailString):
+        """Leave mailString for the outbox to deliver to recipient."""
+        self._lock.acquire()
+        try:
+            if self.outbox is None:
+                self.outbox = self._make_outbox(self.outbox_directory)
+            self.deferred += 1
+        finally:
+            self._lock.release()
+        self.outbox.enqueue(self.url_for(recipient), mailString)
+
+    def start(self):
+        """Serve connections from a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.posters.close()
+        if self.outbox is not None:
+            self.outbox.stop()
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] URL')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8025)
+    parser.add_option('--lmtp', action='store_true',
+                      help='speak LMTP instead of SMTP')
+    parser.add_option('--max-bytes', type='int',
+                      help='reject mails bigger than this')
+    parser.add_option('--strip-attachments', action='store_true')
+    parser.add_option('--outbox',
+                      help='spool directory for SMTP recipients to retry '
+                      '(default: %s-HOST-PORT)' % OUTBOX_LOCATION)
+    parser.add_option('-v', '--verbose', action='store_true')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('need the receiver URL')
+    send_options = {}
+    if options.strip_attachments:
+        send_options['strip_attachments'] = True
+    server = MailListener(args[0], options.host, options.port, options.lmtp,
+                          options.max_bytes, options.verbose, options.outbox,
+                          **send_options)
+    print 'Accepting %s at %s:%s for %s' % (
+        options.lmtp and 'LMTP' or 'SMTP', options.host,
+        server.address[1], args[0])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
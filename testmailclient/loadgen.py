@@ -0,0 +1,201 @@
+"""
+Replay a corpus of mails at a MailBoxer/Listen endpoint as a load test.
+
+Each worker thread keeps its own MailPoster (and so its own keep-alive
+connection); the number of workers bounds the requests in flight.  An
+optional target rate spaces the uploads out evenly across all workers.
+Failures are classified the way send() classifies them: a 404 is a
+bounce (EXIT_NOUSER), anything else a tempfail (EXIT_TEMPFAIL).
+
+  python -m testmailclient.loadgen http://host/lists/foo/manage_mailboxer \\
+      corpus/ --concurrency 8 --rate 50 --count 1000
+
+Pass --local instead of a URL's host to run against a MailReceiver
+started in-process.
+"""
+
+import glob
+import os
+import threading
+import time
+
+from testmailclient.smtp2zope import MailPoster, SendError, NoSuchReceiverError
+from testmailclient.smtp2zope import EXIT_NOUSER, EXIT_TEMPFAIL
+
+def load_corpus(source):
+    """Return the contents of every mail in a directory or glob."""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    mails = []
+    for path in sorted(paths):
+        if not os.path.isfile(path):
+            continue
+        fp = open(path, 'rb')
+        mails.append(fp.read())
+        fp.close()
+    return mails
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    index = int(round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+class LoadReport(object):
+
+    def __init__(self):
+        self.sent = 0
+        self.latencies = []
+        # 'ok', 'nouser' or 'tempfail' -> count
+        self.outcomes = {}
+        # HTTP status, or None for connection errors -> count
+        self.codes = {}
+        self.elapsed = 0.0
+
+    def record(self, outcome, latency, code=None):
+        self.sent += 1
+        self.latencies.append(latency)
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.codes[code] = self.codes.get(code, 0) + 1
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+        return {
+            'sent': self.sent,
+            'elapsed': self.elapsed,
+            'throughput': self.elapsed and self.sent / self.elapsed or 0.0,
+            'outcomes': dict(self.outcomes),
+            'codes': dict((str(code), count)
+                          for code, count in self.codes.items()),
+            'latency': {'p50': percentile(ordered, 0.50),
+                        'p90': percentile(ordered, 0.90),
+                        'p99': percentile(ordered, 0.99),
+                        'max': ordered and ordered[-1] or None},
+            }
+
+    def __str__(self):
+        summary = self.summary()
+        lines = ['%(sent)s mails in %(elapsed).2fs (%(throughput).1f/s)'
+                 % summary]
+        for outcome, count in sorted(summary['outcomes'].items()):
+            exit_code = {'nouser': EXIT_NOUSER,
+                         'tempfail': EXIT_TEMPFAIL}.get(outcome, 0)
+            lines.append('  %-8s %6d  (exit code %s)' % (
+                    outcome, count, exit_code))
+        for code, count in sorted(summary['codes'].items()):
+            lines.append('  HTTP %-4s %6d' % (code, count))
+        latency = summary['latency']
+        if latency['max'] is not None:
+            lines.append('  latency p50 %.1fms  p90 %.1fms  '
+                         'p99 %.1fms  max %.1fms' % tuple(
+                    latency[key] * 1000
+                    for key in ('p50', 'p90', 'p99', 'max')))
+        return '\n'.join(lines)
+
+def replay(callURL, mails, count=None, concurrency=4, rate=None):
+    """Upload count mails (default: each of mails once), cycling
+    through mails, from concurrency worker threads.
+
+    If rate is given, uploads start no faster than rate per second.
+    Returns a LoadReport.
+    """
+    if count is None:
+        count = len(mails)
+    report = LoadReport()
+    lock = threading.Lock()
+    cursor = [0]
+    started = time.time()
+
+    def next_index():
+        lock.acquire()
+        try:
+            index = cursor[0]
+            if index >= count:
+                return None
+            cursor[0] += 1
+            return index
+        finally:
+            lock.release()
+
+    def worker():
+        poster = MailPoster(callURL)
+        try:
+            while True:
+                index = next_index()
+                if index is None:
+                    return
+                if rate:
+                    delay = started + index / float(rate) - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                began = time.time()
+                try:
+                    poster.post(mails[index % len(mails)])
+                except NoSuchReceiverError, e:
+                    outcome, code = 'nouser', e.code
+                except SendError, e:
+                    outcome, code = 'tempfail', e.code
+                else:
+                    outcome, code = 'ok', 200
+                latency = time.time() - began
+                lock.acquire()
+                try:
+                    report.record(outcome, latency, code)
+                finally:
+                    lock.release()
+        finally:
+            poster.close()
+
+    threads = [threading.Thread(target=worker)
+               for i in range(max(1, min(concurrency, count)))]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.elapsed = time.time() - started
+    return report
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] URL CORPUS')
+    parser.add_option('-c', '--concurrency', type='int', default=4,
+                      help='maximum requests in flight')
+    parser.add_option('-r', '--rate', type='float',
+                      help='target uploads per second')
+    parser.add_option('-n', '--count', type='int',
+                      help='total uploads (default: the corpus once)')
+    parser.add_option('--local', action='store_true',
+                      help='send to a MailReceiver started in-process; '
+                      'URL is then just the path, e.g. /lists/foo/manage_mailboxer')
+    parser.add_option('--json', action='store_true',
+                      help='print the report as JSON')
+    options, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.error('need a URL and a corpus directory or glob')
+    callURL, source = args
+    mails = load_corpus(source)
+    if not mails:
+        parser.error('no mails found in %s' % source)
+    server = None
+    if options.local:
+        from testmailclient.receiver import MailReceiver
+        server = MailReceiver().start()
+        callURL = server.url.rstrip('/') + '/' + callURL.lstrip('/')
+    try:
+        report = replay(callURL, mails, options.count,
+                        options.concurrency, options.rate)
+    finally:
+        if server is not None:
+            server.stop()
+    if options.json:
+        import json
+        print json.dumps(report.summary(), indent=2, sort_keys=True)
+    else:
+        print report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Mails stored many to a file, in mbox format.
+
+Some TestMailHost setups append every mail to one mbox file, and
+captured corpora come as mbox archives of several gigabytes.  Rather
+than one path per mail, each message in an mbox is named by a member
+path:
+
+  /var/spool/test.mbox#<start>:<end>
+
+where start and end are the byte offsets of the message (after its
+"From " separator line) in the file.  MboxSource finds those offsets
+by streaming through the file a chunk at a time, and only reads what
+was appended since it last looked; the reader re-reads a member by
+seeking straight to it.  mbox files are only ever appended to, so a
+member is taken never to change once it has been seen.
+"""
+
+import os
+import re
+
+# How much of an mbox to read at a time while scanning it
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+_member = re.compile(r'^(.+)#(\d+):(\d+)$')
+
+# mboxrd escapes body lines starting with "From " (or ">From "...)
+_quoted_from = re.compile(r'^>(>*From )', re.M)
+
+def member_path(mbox, start, end):
+    return '%s#%d:%d' % (mbox, start, end)
+
+def split_member(path):
+    """Return (mbox, start, end) for a member path, or (path, None,
+    None) for the path of an ordinary mail file."""
+    match = _member.match(path)
+    if match is None or os.path.exists(path):
+        return path, None, None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+def unquote(text):
+    return _quoted_from.sub(r'\1', text)
+
+def stat_mail(path):
+    """Return (size, mtime) for the mail at path; raises OSError if it
+    doesn't exist.  A member's mtime is always 0, as it never changes."""
+    mbox, start, end = split_member(path)
+    st = os.stat(mbox)
+    if start is None:
+        return st.st_size, st.st_mtime
+    if st.st_size < end:
+        raise OSError('%s is shorter than member %s' % (mbox, path))
+    return end - start, 0
+
+def mail_exists(path):
+    try:
+        stat_mail(path)
+    except OSError:
+        return False
+    return True
+
+def read_raw(path):
+    """Return the whole of the mail at path, as it is on disk."""
+    mbox, start, end = split_member(path)
+    fp = open(mbox, 'rb')
+    try:
+        if start is None:
+            return fp.read()
+        fp.seek(start)
+        return unquote(fp.read(end - start))
+    finally:
+        fp.close()
+
+class MboxSource(object):
+    """Finds the messages in an mbox file, oldest first, like the
+    sources in testmailclient.spool.
+
+    The last message is only returned once the file ends with a
+    complete blank line, as every message in an mbox does, so that a
+    message still being written isn't picked up half way through.
+    """
+
+    def __init__(self, mbox):
+        self.mbox = os.path.abspath(mbox)
+        self._reset()
+
+    def _reset(self):
+        # (start of the "From " line, start of the message, length of
+        # the blank line before the "From " line) for each message
+        self._messages = []
+        self._first = 0
+        # How far the file has been scanned, and the length of the last
+        # line scanned if it was blank
+        self._scanned = 0
+        self._blank = 0
+        self._size = 0
+
+    def directories(self):
+        return [os.path.dirname(self.mbox)]
+
+    def paths(self):
+        self._scan()
+        return [member_path(self.mbox, start, end)
+                for start, end in self._ranges()]
+
+    def clear(self):
+        """Forget the messages that are there now; only messages
+        appended from here on will be returned."""
+        self._scan()
+        self._first = len(self._messages)
+
+    def _ranges(self):
+        messages = self._messages
+        for index in range(self._first, len(messages)):
+            start = messages[index][1]
+            if index + 1 < len(messages):
+                # The blank line before the next "From " isn't part of
+                # the message.
+                separator, _, blank = messages[index + 1]
+                end = separator - blank
+            elif self._blank and self._scanned == self._size:
+                end = self._scanned - self._blank
+            else:
+                return
+            yield start, max(start, end)
+
+    def _scan(self):
+        try:
+            size = os.stat(self.mbox).st_size
+        except OSError:
+            return
+        if size < self._scanned:
+            # Truncated or replaced: start again.
+            self._reset()
+        self._size = size
+        if size == self._scanned:
+            return
+        fp = open(self.mbox, 'rb')
+        try:
+            fp.seek(self._scanned)
+            pending = ''
+            while True:
+                data = fp.read(SCAN_CHUNK_SIZE)
+                if not data:
+                    break
+                data = pending + data
+                # Only look at complete lines; keep the rest for later.
+                end = data.rfind('\n') + 1
+                pending = data[end:]
+                self._scan_lines(data[:end])
+        finally:
+            fp.close()
+
+    def _scan_lines(self, data):
+        position = self._scanned
+        for line in data.splitlines(True):
+            if line.startswith('From ') and (self._blank or not position):
+                self._messages.append((position, position + len(line),
+                                       self._blank))
+            if line in ('\n', '\r\n'):
+                self._blank = len(line)
+            else:
+                self._blank = 0
+            position += len(line)
+        self._scanned = position
@@ -0,0 +1,280 @@
+"""
+A persistent local spool of outgoing mail, with retrying delivery.
+
+When the receiver is slow or down, send() fails with a tempfail and
+retrying is left to the caller, or to the MTA's slow schedule.  An
+Outbox writes each mail to a spool directory first, and a pool of
+worker threads delivers them through send():
+
+  - a tempfail (SendError) is retried with exponential backoff and
+    full jitter, up to max_delay between attempts;
+  - a 404 (EXIT_NOUSER) or an oversized mail (EXIT_NOPERM) is
+    permanent, and the mail is moved to failed/;
+  - as soon as a mail to a receiver goes through, every mail waiting
+    to retry that receiver is made due at once, so a backlog drains at
+    full speed when the receiver recovers.
+
+The spool is laid out like a maildir: a mail is written to tmp/, then
+renamed into new/, and removed once delivered.  Mails left in new/ by
+an earlier process are picked up again by start().
+"""
+
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from testmailclient import smtp2zope
+from testmailclient.stats import Stats, stats
+
+class Outbox(object):
+
+    def __init__(self, directory, workers=4, base_delay=0.5, max_delay=300,
+                 max_attempts=None, **send_options):
+        self.directory = directory
+        self.workers = workers
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.send_options = send_options
+        for name in ('tmp', 'new', 'failed'):
+            path = os.path.join(directory, name)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self.latency = Stats()
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        # name -> (callURL, attempts, queued at)
+        self._entries = {}
+        # (due, sequence, name), for the entries not being delivered
+        self._due = []
+        self._in_flight = 0
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._random = random.Random()
+
+    def _path(self, folder, name):
+        return os.path.join(self.directory, folder, name)
+
+    def enqueue(self, callURL, mailString):
+        """Spool mailString for delivery to callURL; returns its name."""
+        name = '%.6f.%d.%d.eml' % (time.time(), os.getpid(),
+                                   self._counter.next())
+        tmp = self._path('tmp', name)
+        fp = open(tmp, 'wb')
+        try:
+            fp.write(callURL + '\n')
+            fp.write(mailString)
+        finally:
+            fp.close()
+        os.rename(tmp, self._path('new', name))
+        self._schedule(name, callURL, 0, time.time(), time.time())
+        return name
+
+    def _schedule(self, name, callURL, attempts, queued, due):
+        self._condition.acquire()
+        try:
+            self._entries[name] = (callURL, attempts, queued)
+            heapq.heappush(self._due, (due, self._counter.next(), name))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def _recover(self):
+        for name in sorted(os.listdir(self._path('new', ''))):
+            if name in self._entries:
+                continue
+            path = self._path('new', name)
+            fp = open(path, 'rb')
+            try:
+                callURL = fp.readline().rstrip('\n')
+            finally:
+                fp.close()
+            self._schedule(name, callURL, 0, os.stat(path).st_mtime,
+                           time.time())
+
+    def _read(self, name):
+        fp = open(self._path('new', name), 'rb')
+        try:
+            fp.readline()
+            return fp.read()
+        finally:
+            fp.close()
+
+    def _next(self):
+        """Wait for the next due mail; None once stopped."""
+        self._condition.acquire()
+        try:
+            while not self._stopping:
+                if self._due:
+                    wait = self._due[0][0] - time.time()
+                    if wait <= 0:
+                        due, sequence, name = heapq.heappop(self._due)
+                        self._in_flight += 1
+                        return name
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+            return None
+        finally:
+            self._condition.release()
+
+    def _backoff(self, attempts):
+        # "Full jitter": anywhere between no wait and the capped
+        # exponential delay, so that retries don't arrive in lockstep.
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return self._random.uniform(0, ceiling)
+
+    def _work(self):
+        posters = {}
+        try:
+            while True:
+                name = self._next()
+                if name is None:
+                    return
+                try:
+                    self._deliver(name, posters)
+                finally:
+                    self._condition.acquire()
+                    try:
+                        self._in_flight -= 1
+                        self._condition.notifyAll()
+                    finally:
+                        self._condition.release()
+        finally:
+            for poster in posters.values():
+                poster.close()
+
+    def _deliver(self, name, posters):
+        callURL, attempts, queued = self._entries[name]
+        poster = posters.get(callURL)
+        if poster is None:
+            poster = posters[callURL] = smtp2zope.MailPoster(callURL)
+        error = None
+        try:
+            smtp2zope.send(callURL, self._read(name), poster=poster,
+                           **self.send_options)
+        except SystemExit, e:
+            # Too big: smtp2zope would have exited with EXIT_NOPERM, or
+            # with 0 if MailBoxer was notified instead.
+            if e.code:
+                error = 'exit code %s' % e.code
+                permanent = e.code != smtp2zope.EXIT_TEMPFAIL
+        except smtp2zope.NoSuchReceiverError, e:
+            error, permanent = e, True
+        except Exception, e:
+            error, permanent = e, False
+        attempts += 1
+        if error is None:
+            self._delivered(name, callURL, queued)
+        elif permanent or (self.max_attempts and attempts >= self.max_attempts):
+            smtp2zope.log_error('Giving up on %s after %d attempts: %s' % (
+                    name, attempts, error))
+            self._fail(name)
+        else:
+            delay = self._backoff(attempts)
+            smtp2zope.log_warning('Retrying %s in %.2fs (attempt %d): %s' % (
+                    name, delay, attempts, error))
+            self._condition.acquire()
+            try:
+                self.retries += 1
+            finally:
+                self._condition.release()
+            self._schedule(name, callURL, attempts, queued,
+                           time.time() + delay)
+
+    def _delivered(self, name, callURL, queued):
+        os.unlink(self._path('new', name))
+        latency = time.time() - queued
+        self.latency.record('delivery', latency)
+        stats.record('Outbox.delivery', latency)
+        self._condition.acquire()
+        try:
+            del self._entries[name]
+            self.delivered += 1
+            # The receiver is back: stop waiting out the backoff of
+            # anything else queued for it.
+            now = time.time()
+            rescheduled = False
+            for index, (due, sequence, other) in enumerate(self._due):
+                if due > now and self._entries[other][0] == callURL:
+                    self._due[index] = (now, sequence, other)
+                    rescheduled = True
+            if rescheduled:
+                heapq.heapify(self._due)
+                self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def _fail(self, name):
+        os.rename(self._path('new', name), self._path('failed', name))
+        self._condition.acquire()
+        try:
+            del self._entries[name]
+            self.failed += 1
+        finally:
+            self._condition.release()
+
+    def start(self):
+        """Start the delivery workers, after picking up any mails an
+        earlier process left in the spool."""
+        self._stopping = False
+        self._recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stop the workers once their current deliveries finish.
+        Undelivered mails stay in the spool."""
+        self._condition.acquire()
+        try:
+            self._stopping = True
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def drain(self, timeout=None):
+        """Wait until every queued mail has been delivered or has
+        failed for good; returns False if timeout seconds pass first."""
+        deadline = timeout is not None and time.time() + timeout
+        self._condition.acquire()
+        try:
+            while self._entries:
+                if deadline:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                else:
+                    self._condition.wait()
+            return True
+        finally:
+            self._condition.release()
+
+    def metrics(self):
+        """Queue depth, deliveries, failures, retries and delivery
+        latency (in seconds, from enqueue to delivery)."""
+        self._condition.acquire()
+        try:
+            metrics = {'depth': len(self._entries),
+                       'in_flight': self._in_flight,
+                       'waiting': len(self._due),
+                       'delivered': self.delivered,
+                       'failed': self.failed,
+                       'retries': self.retries}
+        finally:
+            self._condition.release()
+        metrics['latency'] = self.latency.summary().get('delivery')
+        return metrics
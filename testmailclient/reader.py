@@ -0,0 +1,210 @@
+"""
+A lightweight, header-only reader for mail files.
+
+Most of the mail commands only need a header or two, so parsing the
+whole file into an email.message.Message -- attachments and all -- is
+wasted work.  read_mail maps the file into memory, finds the end of
+the header block, and records where each header value and the body
+live in the file.  The body is only read (and kept) once something
+actually asks for it.
+
+A mail may also be one message of an mbox (see testmailclient.mbox);
+then only its part of the file is searched, and its body is read by
+seeking to it.
+
+Mails with the same body -- the copies of one list posting sent to
+each subscriber, say -- share their decoded text parts and links
+through ``bodies``, keyed by a digest of the body and the headers
+that say how to decode it.
+"""
+
+import hashlib
+import mmap
+import re
+
+from testmailclient.cache import BodyCache
+from testmailclient.mbox import split_member, unquote
+from testmailclient.stats import timed
+
+_end_of_headers = re.compile(r'\r?\n\r?\n')
+# Mirrors the header syntax accepted by email.feedparser, including
+# folded continuation lines.
+_header_field = re.compile(
+    r'^([\041-\071\073-\176]+):[ \t]*(.*(?:\r?\n[ \t].*)*)', re.M)
+
+# Decoded text parts and links, shared between mails with the same body
+bodies = BodyCache()
+
+def _map(fp):
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+class MailRecord(object):
+    """Compact description of one mail file.
+
+    ``fields`` holds a (lowercased name, name, start, end) tuple for
+    each header, where start and end are offsets of the value in the
+    header block; ``body_offset`` is where the body begins and ``size``
+    where the mail ends, in ``source``, the file holding the mail.
+    """
+
+    __slots__ = ('path', 'source', 'size', 'head', 'fields', 'body_offset',
+                 '_body', '_body_key', '_text_parts', '_links')
+
+    def __init__(self, path, size, head, fields, body_offset, source=None):
+        self.path = path
+        self.source = source or path
+        self.size = size
+        self.head = head
+        self.fields = fields
+        self.body_offset = body_offset
+        self._body = None
+        self._body_key = None
+        self._text_parts = None
+        self._links = None
+
+    def get(self, name, failobj=None):
+        name = name.lower()
+        for lname, _, start, end in self.fields:
+            if lname == name:
+                return self.head[start:end]
+        return failobj
+
+    __getitem__ = get
+
+    def get_all(self, name, failobj=None):
+        name = name.lower()
+        values = [self.head[start:end]
+                  for lname, _, start, end in self.fields if lname == name]
+        return values or failobj
+
+    def keys(self):
+        return [field[1] for field in self.fields]
+
+    def items(self):
+        return [(field[1], self.head[field[2]:field[3]])
+                for field in self.fields]
+
+    @timed('MailRecord.body', detail=True)
+    def body(self):
+        """Return the raw body of the mail, reading it on first use."""
+        if self._body is None:
+            if self.body_offset >= self.size:
+                self._body = ''
+            elif self.source != self.path:
+                # One message of an mbox: seek to it.
+                fp = open(self.source, 'rb')
+                try:
+                    fp.seek(self.body_offset)
+                    self._body = unquote(
+                        fp.read(self.size - self.body_offset))
+                finally:
+                    fp.close()
+            else:
+                fp = open(self.path, 'rb')
+                try:
+                    mapping = _map(fp)
+                    try:
+                        self._body = mapping[self.body_offset:self.size]
+                    finally:
+                        mapping.close()
+                finally:
+                    fp.close()
+        return self._body
+
+    def body_key(self):
+        """Return a digest identifying the body of the mail, along with
+        the Content-Type and Content-Transfer-Encoding it's decoded by."""
+        if self._body_key is None:
+            digest = hashlib.sha1()
+            for name in ('content-type', 'content-transfer-encoding'):
+                digest.update('%s\0' % (self.get(name) or ''))
+            digest.update(self.body())
+            self._body_key = digest.hexdigest()
+        return self._body_key
+
+    def _shared(self):
+        return bodies.entry(self.body_key(), self.size - self.body_offset)
+
+    def message(self):
+        """Return a fully parsed email.message.Message for this mail."""
+        import email
+        return email.message_from_string(
+            self.head + '\n\n' + self.body())
+
+    @timed('MailRecord.text_parts', detail=True)
+    def text_parts(self):
+        """Return a (content type, decoded text, flowed) tuple for each
+        inline text/* part, decoding the MIME structure on first use.
+
+        flowed is None, or 'flowed' or 'delsp' for format=flowed text
+        without or with DelSp=yes.
+        """
+        if self._text_parts is None:
+            shared = self._shared()
+            if 'text_parts' not in shared:
+                shared['text_parts'] = self._decode_text_parts()
+            self._text_parts = shared['text_parts']
+        return self._text_parts
+
+    def _decode_text_parts(self):
+        parts = []
+        for part in self.message().walk():
+            if part.get_content_maintype() != 'text':
+                continue
+            disposition = part.get('Content-Disposition', '')
+            if disposition.lower().startswith('attachment'):
+                continue
+            text = part.get_payload(decode=True)
+            if text is None:
+                continue
+            flowed = None
+            if str(part.get_param('format', '')).lower() == 'flowed':
+                flowed = 'flowed'
+                if str(part.get_param('delsp', '')).lower() == 'yes':
+                    flowed = 'delsp'
+            parts.append((part.get_content_type(), text, flowed))
+        return parts
+
+    def links(self):
+        """Return the links in the mail's text, in order."""
+        if self._links is None:
+            shared = self._shared()
+            if 'links' not in shared:
+                from testmailclient.links import extract_links
+                shared['links'] = extract_links(self.text_parts())
+            self._links = shared['links']
+        return self._links
+
+@timed('read_mail', detail=True)
+def read_mail(path):
+    """Read the header block of the mail at path into a MailRecord."""
+    source, start, size = split_member(path)
+    fp = open(source, 'rb')
+    try:
+        if start is None:
+            start = 0
+            fp.seek(0, 2)
+            size = fp.tell()
+        if size <= start:
+            return MailRecord(path, start, '', (), start, source)
+        mapping = _map(fp)
+        try:
+            match = _end_of_headers.search(mapping, start, size)
+            if match is None:
+                head = mapping[start:size]
+                body_offset = size
+            else:
+                head = mapping[start:match.start()]
+                body_offset = match.end()
+        finally:
+            mapping.close()
+    finally:
+        fp.close()
+    fields = []
+    for match in _header_field.finditer(head):
+        end = match.end(2)
+        if head[end - 1:end] == '\r':
+            end -= 1
+        fields.append((match.group(1).lower(), match.group(1),
+                       match.start(2), end))
+    return MailRecord(path, size, head, tuple(fields), body_offset, source)
@@ -0,0 +1,209 @@
+"""
+A local stand-in for a MailBoxer/Listen endpoint running TestMailHost.
+
+It accepts the same ``Mail=`` POST that send() makes, writes each mail
+to a file in a spool directory the way TestMailHost does, and reports
+the file's path back in the debug-mail-location cookie.  This is
+enough to exercise the sender and the mail commands on a box with no
+Zope around:
+
+  python -m testmailclient.receiver --port 8080 --spool /tmp/spool
+"""
+
+import BaseHTTPServer
+import SocketServer
+import cgi
+import itertools
+import os
+import tempfile
+import threading
+import time
+
+class MailReceiverHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers go out in several small writes; don't let Nagle hold
+    # them back on kept-alive connections.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+    def do_POST(self):
+        server = self.server
+        body = self._read_body()
+        if server.delay:
+            time.sleep(server.delay)
+        if server.lists is not None and self._list_name() not in server.lists:
+            return self._respond(404, 'Not Found')
+        form = cgi.parse_qs(body)
+        if 'Mail' not in form:
+            return self._respond(400, 'No Mail in request')
+        mailpath = server.store(form['Mail'][0])
+        self._respond(200, 'TRUE', {
+                'Set-Cookie': 'debug-mail-location="%s"; Path=/' % mailpath})
+
+    def do_GET(self):
+        # Stands in for the confirmation and unsubscribe pages that
+        # links in list mail point at.
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self._respond(200, 'OK %s' % self.path)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                if not size:
+                    # Skip any trailers.
+                    while self.rfile.readline().strip():
+                        pass
+                    return ''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def _list_name(self):
+        # http://host/lists/<list>/manage_mailboxer
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        if len(parts) < 2:
+            return None
+        return parts[-2]
+
+    def _respond(self, code, text, headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+class MailReceiver(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A threaded HTTP server that spools every posted mail to a file.
+
+    If ``lists`` is given, only URLs of the form .../<list>/<method>
+    for one of those list names are accepted and anything else gets a
+    404, like posting to a MailBoxer that doesn't exist.  ``delay``
+    adds that many seconds to every response.  Any GET is answered
+    with a 200, for checking links in mails.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, spool=None, host='127.0.0.1', port=0,
+                 lists=None, delay=0, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port),
+                                           MailReceiverHandler)
+        if spool is None:
+            spool = tempfile.mkdtemp(prefix='testmailhost-')
+        elif not os.path.isdir(spool):
+            os.makedirs(spool)
+        self.spool = spool
+        self.lists = lists
+        self.delay = delay
+        self.verbose = verbose
+        self.received = 0
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%s/' % (host, port)
+
+    def store(self, mailString):
+        self._lock.acquire()
+        try:
+            self.received += 1
+            number = self._counter.next()
+        finally:
+            self._lock.release()
+        mailpath = os.path.join(self.spool, 'mail-%s-%06d.eml' % (
+                os.getpid(), number))
+        fp = open(mailpath, 'wb')
+        fp.write(mailString)
+        fp.close()
+        return mailpath
+
+    def start(self):
+        """Serve requests from a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+def synthetic_mail(number, attachment_size=0, recipient=None):
+    """Return a plausible list mail, optionally with a base64 attachment
+    of attachment_size bytes."""
+    recipient = recipient or 'member%d@example.org' % number
+    text = ('Hello %s,\n\n'
+            'Please confirm your subscription by visiting\n'
+            'http://lists.example.org/confirm?key=%08x\n\n'
+            'To unsubscribe, go to https://lists.example.org/unsubscribe/%d\n'
+            % (recipient, number, number))
+    headers = ('From: list-owner@lists.example.org\n'
+               'To: %s\n'
+               'Subject: Message %d\n'
+               'Message-Id: <%d.synthetic@lists.example.org>\n'
+               'MIME-Version: 1.0\n' % (recipient, number, number))
+    if not attachment_size:
+        return headers + 'Content-Type: text/plain\n\n' + text
+    boundary = '==boundary-%d==' % number
+    payload = ('x' * attachment_size).encode('base64')
+    return (headers +
+            'Content-Type: multipart/mixed; boundary="%s"\n\n' % boundary +
+            '--%s\nContent-Type: text/plain\n\n%s\n' % (boundary, text) +
+            '--%s\nContent-Type: application/octet-stream\n'
+            'Content-Transfer-Encoding: base64\n'
+            'Content-Disposition: attachment; filename="data.bin"\n\n'
+            '%s\n--%s--\n' % (boundary, payload, boundary))
+
+def write_spool(spool, count, attachment_size=0):
+    """Write count synthetic mails into the directory spool, one file
+    each as TestMailHost does, and return their paths in order."""
+    if not os.path.isdir(spool):
+        os.makedirs(spool)
+    mailpaths = []
+    for number in range(count):
+        mailpath = os.path.join(spool, 'mail-%06d.eml' % number)
+        fp = open(mailpath, 'wb')
+        fp.write(synthetic_mail(number, attachment_size))
+        fp.close()
+        mailpaths.append(mailpath)
+    return mailpaths
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--spool', help='directory to write mails to')
+    parser.add_option('--list', action='append', dest='lists',
+                      help='accept only this list name (repeatable)')
+    parser.add_option('--delay', type='float', default=0,
+                      help='seconds to wait before each response')
+    options, args = parser.parse_args(argv)
+    server = MailReceiver(options.spool, options.host, options.port,
+                          options.lists, options.delay, verbose=True)
+    print 'Receiving mail at %s, spooling to %s' % (server.url, server.spool)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
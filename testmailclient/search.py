@@ -0,0 +1,98 @@
+"""
+Searching many mails for many strings at once.
+
+All the needles (or regular expressions) are combined into a single
+alternation, so each mail's text is scanned once however many needles
+there are, stopping early once every needle has been seen.  A needle
+can be hidden from that scan by another one matching at the same
+place, so any that weren't seen get one direct search of their own
+before we conclude they're missing.
+
+Mails are searched in the decoded text of their text/* parts, so
+multipart, quoted-printable and base64 mails work.  Regular expressions
+with inline flags, named groups or backreferences would change meaning
+(or not compile) inside the alternation, so each of those is left out
+of it and searched for on its own.
+"""
+
+import re
+
+# Python 2's re module can't handle more than 100 groups in a pattern.
+_MAX_GROUPS = 99
+
+# Inline flags (which apply to the whole pattern they end up in),
+# lookarounds and other extensions, and numbered backreferences
+_extension = re.compile(r'\(\?[^:]|\\[1-9]')
+
+def _combinable(pattern):
+    return not pattern.groupindex and _extension.search(pattern.pattern) is None
+
+def mail_text(record):
+    """Return the decoded text of all of a mail's text parts."""
+    return '\n'.join([text for _, text, _ in record.text_parts()])
+
+class MultiSearch(object):
+
+    def __init__(self, needles, regex=False):
+        self.needles = list(needles)
+        if regex:
+            self._patterns = [re.compile(needle) for needle in self.needles]
+        else:
+            self._patterns = [re.compile(re.escape(needle))
+                              for needle in self.needles]
+        # Try longer literals first, so they're less often hidden by
+        # a shorter needle matching at the same position.
+        order = range(len(self.needles))
+        if not regex:
+            order.sort(key=lambda i: -len(self.needles[i]))
+        self._combined = []
+        batch, groups, owners = [], 0, {}
+        for i in order:
+            pattern = self._patterns[i]
+            if not _combinable(pattern):
+                continue
+            if batch and groups + 1 + pattern.groups > _MAX_GROUPS:
+                self._combined.append((re.compile('|'.join(batch)), owners))
+                batch, groups, owners = [], 0, {}
+            groups += 1
+            owners[groups] = i
+            groups += pattern.groups
+            batch.append('(%s)' % pattern.pattern)
+        if batch:
+            self._combined.append((re.compile('|'.join(batch)), owners))
+
+    def search(self, text):
+        """Return a list of booleans, one per needle, saying whether it
+        occurs in text."""
+        found = [False] * len(self.needles)
+        missing = len(self.needles)
+        for combined, owners in self._combined:
+            for match in combined.finditer(text):
+                # An alternative's own group is the last to close.
+                i = owners[match.lastindex]
+                if not found[i]:
+                    found[i] = True
+                    missing -= 1
+                    if not missing:
+                        return found
+        for i, pattern in enumerate(self._patterns):
+            if not found[i] and pattern.search(text) is not None:
+                found[i] = True
+        return found
+
+def search_mails(records, needles, regex=False):
+    """Search each record for every needle.
+
+    Returns the match matrix as a list with one (path, [found, ...])
+    row per record.  Records with the same body (see
+    MailRecord.body_key) are only searched once.
+    """
+    searcher = MultiSearch(needles, regex)
+    found = {}
+    rows = []
+    for record in records:
+        key = record.body_key()
+        if key not in found:
+            found[key] = searcher.search(mail_text(record))
+        rows.append((record.path, list(found[key])))
+    return rows
@@ -0,0 +1,60 @@
+"""
+Separate mail sessions, for running many simulated users in threads.
+
+The mail commands normally keep their state in module globals: twill's
+one browser, whose debug-mail-location cookie lists the mails sent;
+the selected mail, in the twill locals; and one parse cache and header
+index.  A MailSession carries its own of each.  While a session is
+active in a thread, the mail commands called from that thread use it
+instead of the globals:
+
+  def user(number):
+      with MailSession():
+          send_mail('signup-%d.eml' % number, receiverURL)
+          select_mail_from_header('To', 'user%d@example.org' % number)
+          click_link_in_mail()
+
+Sessions still share the bodies shared between identical mails (see
+testmailclient.reader) and the stats, both of which are locked.
+"""
+
+import threading
+
+from testmailclient.cache import MailCache, DEFAULT_MAX_BYTES
+from testmailclient.index import HeaderIndex
+from testmailclient.reader import read_mail
+
+_local = threading.local()
+
+def current_session():
+    """Return the session active in this thread, or None."""
+    return getattr(_local, 'session', None)
+
+def set_session(session):
+    """Make session the one the mail commands use in this thread (None
+    for the globals), returning the one that was active before."""
+    previous = current_session()
+    _local.session = session
+    return previous
+
+class MailSession(object):
+
+    def __init__(self, browser=None, mail_source=None,
+                 cache_bytes=DEFAULT_MAX_BYTES):
+        if browser is None:
+            from twill.browser import TwillBrowser
+            browser = TwillBrowser()
+        self.browser = browser
+        # None to follow the browser's debug-mail-location cookie, as
+        # for _mail_source in testmailclient
+        self.mail_source = mail_source
+        self.selected_mail = None
+        self.cache = MailCache(read_mail, cache_bytes)
+        self.index = HeaderIndex()
+
+    def __enter__(self):
+        _local.__dict__.setdefault('previous', []).append(set_session(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        set_session(_local.previous.pop())
@@ -0,0 +1,160 @@
+"""
+Mail sources that don't depend on the debug-mail-location cookie.
+
+The cookie has to be re-split on every get_mail() and runs into the
+browser's cookie size limit after a few dozen paths.  When the client
+can see TestMailHost's output directly, these sources find the mails
+there instead:
+
+DirectorySource
+  scans the spool directory TestMailHost writes mails into, listing it
+  again only when the directory has changed.  A Maildir (a directory
+  with cur/ and new/ in it) is scanned in both.
+
+ManifestSource
+  follows a manifest file the server appends one mail path per line
+  to.  Only the newly appended part is ever read, and the offset of
+  the last clear_mail() is kept in a state file next to the manifest,
+  so that separate twill processes agree on which mails are current.
+
+These, and testmailclient.mbox.MboxSource, return mails oldest
+first, like the cookie does.  DirectorySource goes by each file's
+mtime when it first sees it, then by name.
+"""
+
+import os
+import time
+
+class DirectorySource(object):
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.maildir = (os.path.isdir(os.path.join(self.directory, 'cur')) and
+                        os.path.isdir(os.path.join(self.directory, 'new')))
+        # unique name -> current path, and the unique names to return
+        self._seen = {}
+        self._current = []
+        self._scanned_mtime = None
+        self._scanned_at = 0
+
+    def directories(self):
+        if self.maildir:
+            return [os.path.join(self.directory, 'new'),
+                    os.path.join(self.directory, 'cur')]
+        return [self.directory]
+
+    def paths(self):
+        self._scan()
+        return [self._seen[key] for key in self._current]
+
+    def clear(self):
+        """Forget the mails that are there now; only mails written
+        from here on will be returned."""
+        self._scan(force=True)
+        self._current = []
+
+    def _scan(self, force=False):
+        directories = self.directories()
+        mtime = max([os.stat(directory).st_mtime for directory in directories])
+        # A directory modified within the same clock tick as our last
+        # listing may have changed again since; only trust an mtime
+        # that was already a second old when we looked.
+        if (not force and mtime == self._scanned_mtime
+            and mtime < self._scanned_at - 1):
+            return
+        self._scanned_at = time.time()
+        self._scanned_mtime = mtime
+        found = []
+        for directory in directories:
+            for name in os.listdir(directory):
+                if name.startswith('.'):
+                    continue
+                key = name
+                if self.maildir:
+                    # A mail keeps its unique name when it moves from
+                    # new/ to cur/ and gains ":2,<flags>".
+                    key = name.split(':', 1)[0]
+                path = os.path.join(directory, name)
+                if key in self._seen:
+                    self._seen[key] = path
+                    continue
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    # Moved (from new/ to cur/, say) since the listing;
+                    # we'll see it under its new name next time.
+                    continue
+                found.append((mtime, key, path))
+        found.sort()
+        for mtime, key, path in found:
+            self._seen[key] = path
+            self._current.append(key)
+
+class ManifestSource(object):
+
+    def __init__(self, manifest, statefile=None):
+        self.manifest = os.path.abspath(manifest)
+        self.statefile = statefile or self.manifest + '.offset'
+        self._paths = []
+        self._offset = self._load_offset()
+
+    def directories(self):
+        return [os.path.dirname(self.manifest)]
+
+    def paths(self):
+        self._read()
+        return list(self._paths)
+
+    def clear(self):
+        """Forget the mails listed so far, here and in any other
+        process following the same manifest."""
+        self._read()
+        self._paths = []
+        self._save_offset()
+
+    def _read(self):
+        try:
+            fp = open(self.manifest, 'rb')
+        except IOError:
+            return
+        try:
+            fp.seek(0, 2)
+            size = fp.tell()
+            if size < self._offset:
+                # The manifest was truncated or replaced; start over.
+                self._offset = 0
+                self._paths = []
+            if size == self._offset:
+                return
+            fp.seek(self._offset)
+            data = fp.read(size - self._offset)
+        finally:
+            fp.close()
+        # Leave any partly written last line for next time.
+        end = data.rfind('\n') + 1
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if line:
+                self._paths.append(os.path.join(
+                        os.path.dirname(self.manifest), line))
+        self._offset += end
+
+    def _load_offset(self):
+        try:
+            fp = open(self.statefile)
+        except IOError:
+            return 0
+        try:
+            try:
+                return int(fp.read().strip() or 0)
+            except ValueError:
+                return 0
+        finally:
+            fp.close()
+
+    def _save_offset(self):
+        tmpname = '%s.%d' % (self.statefile, os.getpid())
+        fp = open(tmpname, 'w')
+        fp.write('%d\n' % self._offset)
+        fp.close()
+        os.rename(tmpname, self.statefile)
@@ -0,0 +1,198 @@
+"""
+In-process timing of the mail commands and the sender.
+
+Everything decorated with @timed (or wrapped in a timer() block)
+records how long each call took under its name.  The mail_stats command
+prints counts, totals and p50/p95/max per name.  Counts, totals and
+maxima are exact; the percentiles come from a random sample of at most
+RESERVOIR_SIZE calls per name, so memory stays bounded however long a
+run goes on.
+
+Operations done once per mail inside a command (reading and decoding
+each mail) are only timed in detailed mode, as timing them costs about
+as much as a cached lookup.  Environment variables hook into a whole
+run:
+
+  TESTMAILCLIENT_STATS=<file>
+      write the collected stats to <file> as JSON when the process
+      exits; turns on detailed mode
+
+  TESTMAILCLIENT_STATS_DETAIL=1
+      turn on detailed mode
+
+  TESTMAILCLIENT_PROFILE=<name>[:<file>]
+      run every call of the timed operation <name> under cProfile, and
+      write the profile to <file> (default <name>.prof) at exit
+"""
+
+import atexit
+import functools
+import os
+import random
+import threading
+import time
+
+# How many durations are kept per operation for the percentiles
+RESERVOIR_SIZE = 1024
+
+class _Series(object):
+
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+class Stats(object):
+
+    def __init__(self, reservoir_size=RESERVOIR_SIZE):
+        self.reservoir_size = reservoir_size
+        self.detailed = False
+        self._series = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self.profile_name = None
+        self.profile_file = None
+        self._profiler = None
+
+    def record(self, name, seconds):
+        self._lock.acquire()
+        try:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = _Series()
+            series.count += 1
+            series.total += seconds
+            if seconds > series.max:
+                series.max = seconds
+            # Reservoir sampling: every call so far has the same chance
+            # of being among the samples.
+            if len(series.samples) < self.reservoir_size:
+                series.samples.append(seconds)
+            else:
+                index = self._random.randrange(series.count)
+                if index < self.reservoir_size:
+                    series.samples[index] = seconds
+        finally:
+            self._lock.release()
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def summary(self):
+        """Return {name: {count, total, p50, p95, max}}, in seconds."""
+        self._lock.acquire()
+        try:
+            rows = [(name, series.count, series.total, series.max,
+                     sorted(series.samples))
+                    for name, series in self._series.items()]
+        finally:
+            self._lock.release()
+        summary = {}
+        for name, count, total, longest, samples in rows:
+            summary[name] = {'count': count,
+                             'total': total,
+                             'p50': _percentile(samples, 0.50),
+                             'p95': _percentile(samples, 0.95),
+                             'max': longest}
+        return summary
+
+    def format(self):
+        lines = ['%-32s %8s %10s %10s %10s %10s' % (
+                'operation', 'count', 'total ms', 'p50 ms', 'p95 ms', 'max ms')]
+        for name, row in sorted(self.summary().items()):
+            lines.append('%-32s %8d %10.2f %10.3f %10.3f %10.3f' % (
+                    name, row['count'], row['total'] * 1000, row['p50'] * 1000,
+                    row['p95'] * 1000, row['max'] * 1000))
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        import json
+        fp = open(path, 'w')
+        try:
+            json.dump(self.summary(), fp, indent=2, sort_keys=True)
+        finally:
+            fp.close()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._series.clear()
+        finally:
+            self._lock.release()
+
+    def profile(self, name, path=None):
+        """Run every call of the operation called name under cProfile,
+        saving the profile to path when the process exits."""
+        import cProfile
+        if self._profiler is None:
+            atexit.register(self._save_profile)
+        self.profile_name = name
+        self.profile_file = path or '%s.prof' % name
+        self._profiler = cProfile.Profile()
+
+    def call(self, name, fn, args, kw):
+        started = time.time()
+        try:
+            if name == self.profile_name and self._profiler is not None:
+                return self._profiler.runcall(fn, *args, **kw)
+            return fn(*args, **kw)
+        finally:
+            self.record(name, time.time() - started)
+
+    def _save_profile(self):
+        if self._profiler is not None:
+            self._profiler.dump_stats(self.profile_file)
+
+class _Timer(object):
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.record(self.name, time.time() - self.started)
+
+def _percentile(ordered, fraction):
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+stats = Stats()
+
+def timed(name, detail=False):
+    """Decorator recording the duration of every call.
+
+    Use it bare, to record under the function's name, or as
+    @timed('some.name') to choose the name.  With detail, calls are
+    only recorded (or profiled) in detailed mode, or when the operation
+    is being profiled.
+    """
+    if callable(name):
+        return timed(name.__name__)(name)
+    def decorate(fn):
+        if detail:
+            @functools.wraps(fn)
+            def wrapper(*args, **kw):
+                if stats.detailed or stats.profile_name == name:
+                    return stats.call(name, fn, args, kw)
+                return fn(*args, **kw)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kw):
+                return stats.call(name, fn, args, kw)
+        return wrapper
+    return decorate
+
+if os.environ.get('TESTMAILCLIENT_STATS_DETAIL'):
+    stats.detailed = True
+if os.environ.get('TESTMAILCLIENT_STATS'):
+    stats.detailed = True
+    atexit.register(stats.dump, os.environ['TESTMAILCLIENT_STATS'])
+if os.environ.get('TESTMAILCLIENT_PROFILE'):
+    _name, _, _path = os.environ['TESTMAILCLIENT_PROFILE'].partition(':')
+    stats.profile(_name, _path or None)
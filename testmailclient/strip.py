@@ -0,0 +1,150 @@
+"""
+Strip a mail down to its plain text part, a line at a time.
+
+This replaces the MailBoxerTools unpackMail/getPlainBodyFromMail pair
+that send() used for STRIP_ATTACHMENTS, which parsed the whole mail
+into memory and then built a new one from it.  Each header block (the
+mail's own, and each part's) is parsed with email.feedparser.FeedParser;
+bodies are walked line by line and only the first inline text/plain
+part is kept, still in its original transfer encoding.  So no more
+than the headers and that text part are ever held in memory, however
+big the attachments are.
+"""
+
+from email.feedparser import FeedParser
+
+# Event codes MailBoxer's manage_event understands
+EVENT_STRIPPED_HTML = 100
+EVENT_STRIPPED_ATTACHMENTS = 101
+
+# Headers of the kept part that replace the mail's own
+_CONTENT_HEADERS = ('content-type', 'content-transfer-encoding')
+
+def _read_header_block(lines):
+    """Read up to and including the blank line ending a header block."""
+    block = []
+    for line in lines:
+        if not line.strip():
+            return block, line
+        block.append(line)
+    return block, ''
+
+def _parse_headers(block, eol):
+    parser = FeedParser()
+    parser.feed(''.join(block))
+    parser.feed(eol)
+    return parser.close()
+
+def _fields(block):
+    """Group header lines into (lowercased name, lines) fields, keeping
+    folded continuation lines with their header."""
+    fields = []
+    for line in block:
+        if line[:1] in (' ', '\t') and fields:
+            fields[-1][1].append(line)
+        else:
+            fields.append((line.split(':', 1)[0].strip().lower(), [line]))
+    return fields
+
+def _delimiter(line, boundaries):
+    """Return (index of the boundary, closing?) if line delimits a part
+    of one of the open multiparts, else None."""
+    if not line.startswith('--'):
+        return None
+    text = line.rstrip()
+    for index in range(len(boundaries) - 1, -1, -1):
+        boundary = '--' + boundaries[index]
+        if text == boundary:
+            return index, False
+        if text == boundary + '--':
+            return index, True
+    return None
+
+def _chop_eol(line):
+    # The line break before a delimiter belongs to the delimiter.
+    if line.endswith('\r\n'):
+        return line[:-2]
+    if line.endswith('\n'):
+        return line[:-1]
+    return line
+
+def strip_attachments(lines):
+    """Reduce the mail read from lines (a file, or any iterable of
+    lines with their line endings) to its headers and first inline
+    text/plain part.
+
+    Returns (mail, event_codes).  If nothing was stripped, mail is None
+    and the original should be sent as it is.
+    """
+    lines = iter(lines)
+    head, blank = _read_header_block(lines)
+    eol = head and head[0].endswith('\r\n') and '\r\n' or '\n'
+    msg = _parse_headers(head, eol)
+    boundary = msg.get_param('boundary')
+    if msg.get_content_maintype() != 'multipart' or not boundary:
+        return None, []
+
+    boundaries = [boundary]
+    kept_headers = None
+    kept = []
+    html = attachments = 0
+    mode = 'skip'       # skip, headers or keep
+    part_head = []
+    for line in lines:
+        delimiter = _delimiter(line, boundaries)
+        if delimiter is not None:
+            index, closing = delimiter
+            if mode == 'keep' and kept:
+                kept[-1] = _chop_eol(kept[-1])
+            # Closing an outer multipart closes any left open inside it.
+            del boundaries[index + 1:]
+            if closing:
+                boundaries.pop()
+                mode = 'skip'
+            else:
+                mode = 'headers'
+                part_head = []
+            continue
+        if mode == 'headers':
+            if line.strip():
+                part_head.append(line)
+                continue
+            part = _parse_headers(part_head, eol)
+            ctype = part.get_content_type()
+            disposition = (part.get('content-disposition') or '').lower()
+            mode = 'skip'
+            if part.get_content_maintype() == 'multipart':
+                if part.get_param('boundary'):
+                    boundaries.append(part.get_param('boundary'))
+            elif (ctype == 'text/plain' and kept_headers is None
+                  and not disposition.startswith('attachment')):
+                kept_headers = [field for field in _fields(part_head)
+                                if field[0] in _CONTENT_HEADERS]
+                mode = 'keep'
+            elif ctype == 'text/html':
+                html += 1
+            else:
+                attachments += 1
+        elif mode == 'keep':
+            kept.append(line)
+
+    if not html and not attachments:
+        return None, []
+    event_codes = []
+    if html:
+        event_codes.append(EVENT_STRIPPED_HTML)
+    if attachments:
+        event_codes.append(EVENT_STRIPPED_ATTACHMENTS)
+
+    out = []
+    for name, field in _fields(head):
+        if name not in _CONTENT_HEADERS:
+            out.extend(field)
+    if kept_headers:
+        for name, field in kept_headers:
+            out.extend(field)
+    else:
+        out.append('Content-Type: text/plain' + eol)
+    out.append(blank or eol)
+    out.extend(kept)
+    return ''.join(out), event_codes
@@ -0,0 +1,119 @@
+"""
+Waiting for mail to show up on disk.
+
+TestMailHost may write a mail some time after the request that sent it
+has returned.  Rather than sleeping for a fixed time, wait_until
+re-checks a predicate whenever something changes in the directories
+the mails are written to.  On Linux we are told about changes by
+inotify; elsewhere we fall back to polling, checking often at first
+and backing off the longer we wait.
+"""
+
+import errno
+import os
+import select
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 04000
+IN_CLOEXEC = 02000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_libc = None
+_libc_loaded = False
+
+def _load_libc():
+    # Loaded on first use: find_library can take a while.
+    global _libc, _libc_loaded
+    if _libc_loaded:
+        return _libc
+    _libc_loaded = True
+    import ctypes
+    import ctypes.util
+    name = ctypes.util.find_library('c')
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+    if hasattr(libc, 'inotify_init1'):
+        _libc = libc
+    return _libc
+
+class InotifyWatcher(object):
+    """Blocks until inotify reports a change in one of directories."""
+
+    def __init__(self, directories):
+        import ctypes
+        libc = _load_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        for directory in directories:
+            if libc.inotify_add_watch(self.fd, directory, WATCH_MASK) < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(),
+                              'cannot watch %s' % directory)
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def close(self):
+        if self.fd is not None and self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+
+class PollingWatcher(object):
+    """Sleeps for a little longer each time it is asked to wait."""
+
+    def __init__(self, directories=(), initial=0.01, factor=1.5, maximum=0.5):
+        self.interval = initial
+        self.factor = factor
+        self.maximum = maximum
+
+    def wait(self, timeout):
+        time.sleep(min(self.interval, timeout))
+        self.interval = min(self.interval * self.factor, self.maximum)
+
+    def close(self):
+        pass
+
+def make_watcher(directories):
+    directories = [d for d in directories if os.path.isdir(d)]
+    if directories and _load_libc() is not None:
+        try:
+            return InotifyWatcher(directories)
+        except OSError:
+            pass
+    return PollingWatcher(directories)
+
+def wait_until(predicate, timeout, directories=()):
+    """Return the first true value of predicate() seen within timeout
+    seconds, or None if it never becomes true."""
+    deadline = time.time() + timeout
+    # Start watching before the first check, so that nothing written
+    # in between can be missed.
+    watcher = make_watcher(directories)
+    try:
+        while True:
+            result = predicate()
+            if result:
+                return result
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            watcher.wait(remaining)
+    finally:
+        watcher.close()
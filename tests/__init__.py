@@ -0,0 +1,3 @@
+# twill puts its own copy of subprocess first on sys.path, which
+# multiprocessing can't use; import it before any test imports twill.
+import multiprocessing
@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from testmailclient.dbindex import MailDatabase
+
+MAIL = """\
+To: %(to)s
+Subject: mail %(number)d
+
+body
+"""
+
+def index_mails(args):
+    # Run in a pool worker: open the shared database and index the mails.
+    database_path, mailpaths = args
+    database = MailDatabase(database_path)
+    database.update(mailpaths)
+    return sorted(database.lookup('to', 'shared@example.org'))
+
+class MailDatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_path = os.path.join(self.directory, 'index.sqlite')
+        self.mailpaths = []
+        for number in range(4):
+            path = os.path.join(self.directory, 'mail%d' % number)
+            fp = open(path, 'wb')
+            fp.write(MAIL % {'to': 'shared@example.org', 'number': number})
+            fp.close()
+            self.mailpaths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup_and_value(self):
+        database = MailDatabase(self.database_path)
+        database.update(self.mailpaths)
+        self.assertEqual(sorted(database.lookup('To', 'shared@example.org')),
+                         sorted(self.mailpaths))
+        self.assertEqual(database.value(self.mailpaths[2], 'Subject'),
+                         'mail 2')
+        self.failIf(database.lookup('to', 'nobody@example.org'))
+
+    def test_reindexes_changed_mail(self):
+        database = MailDatabase(self.database_path)
+        database.update(self.mailpaths)
+        path = self.mailpaths[0]
+        fp = open(path, 'wb')
+        fp.write(MAIL % {'to': 'other@example.org', 'number': 10})
+        fp.close()
+        os.utime(path, (0, 0))
+        database.update(self.mailpaths)
+        self.assertEqual(database.value(path, 'to'), 'other@example.org')
+        self.failIf(path in database.lookup('to', 'shared@example.org'))
+
+    def test_processes_opening_a_new_database(self):
+        # Regression: processes creating the schema at the same time
+        # failed with "database schema has changed".
+        pool = multiprocessing.Pool(8)
+        try:
+            results = pool.map(index_mails,
+                               [(self.database_path, self.mailpaths)] * 16)
+        finally:
+            pool.close()
+            pool.join()
+        for result in results:
+            self.assertEqual(result, sorted(self.mailpaths))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import smtplib
+import tempfile
+import unittest
+
+from testmailclient import listener
+from testmailclient.listener import MailListener
+from testmailclient.outbox import Outbox
+from testmailclient.receiver import MailReceiver, synthetic_mail
+
+URL = '%slists/{list}/manage_mailboxer'
+
+class SMTPListenerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saved_location = listener.OUTBOX_LOCATION
+        listener.OUTBOX_LOCATION = os.path.join(self.directory, 'outbox')
+        self.receiver = MailReceiver(os.path.join(self.directory, 'spool'),
+                                     lists=['a', 'b']).start()
+        self.listeners = []
+
+    def tearDown(self):
+        for server in self.listeners:
+            server.stop()
+        self.receiver.stop()
+        listener.OUTBOX_LOCATION = self.saved_location
+        shutil.rmtree(self.directory)
+
+    def listen(self, **kw):
+        server = MailListener(URL % self.receiver.url, **kw).start()
+        self.listeners.append(server)
+        return server
+
+    def client(self, server):
+        client = smtplib.SMTP(*server.address)
+        self.addCleanup(client.quit)
+        return client
+
+    def test_one_unknown_list_per_message(self):
+        client = self.client(self.listen())
+        refused = client.sendmail('x@example.org', ['a@l', 'b@l', 'zz@l'],
+                                  synthetic_mail(1))
+        self.assertEqual(sorted(refused), ['b@l', 'zz@l'])
+        self.assertEqual(refused['b@l'][0], 452)
+        self.assertEqual(self.receiver.received, 1)
+        # Known lists may share a message once they have taken one.
+        client.sendmail('x@example.org', ['b@l'], synthetic_mail(2))
+        client.sendmail('x@example.org', ['a@l', 'b@l'], synthetic_mail(3))
+        self.assertEqual(self.receiver.received, 4)
+        # A missing list fails its own message, so the client can bounce it.
+        try:
+            client.sendmail('x@example.org', ['zz@l'], synthetic_mail(4))
+        except smtplib.SMTPDataError, e:
+            self.assertEqual(e.smtp_code, 550)
+        else:
+            self.fail('no 550')
+
+    def test_keeps_mail_for_list_gone_since(self):
+        server = self.listen()
+        client = self.client(server)
+        client.sendmail('x@example.org', ['a@l'], synthetic_mail(1))
+        client.sendmail('x@example.org', ['b@l'], synthetic_mail(2))
+        self.receiver.lists.remove('a')
+        self.assertEqual(client.sendmail('x@example.org', ['a@l', 'b@l'],
+                                         synthetic_mail(3)), {})
+        self.failUnless(server.outbox.drain(10))
+        failed = os.path.join(server.outbox_directory, 'failed')
+        self.assertEqual(len(os.listdir(failed)), 1)
+
+    def test_recovers_default_outbox(self):
+        first = MailListener(URL % self.receiver.url)
+        port = first.address[1]
+        directory = first.outbox_directory
+        first.server_close()
+        self.failUnless(directory.startswith(listener.OUTBOX_LOCATION))
+        Outbox(directory).enqueue(first.url_for('a@l'), synthetic_mail(1))
+        server = self.listen(port=port)
+        self.assertEqual(server.outbox_directory, directory)
+        self.failUnless(server.outbox.drain(10))
+        self.assertEqual(self.receiver.received, 1)
+
+if __name__ == '__main__':
+    unittest.main()
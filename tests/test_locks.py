@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from testmailclient import smtp2zope
+from testmailclient.smtp2zope import (LockFile, AlreadyLockedError,
+                                      NotLockedError, TimeOutError,
+                                      make_lock)
+
+class LockBackendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lockfile = os.path.join(self.directory, 'test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def backends(self):
+        return sorted(smtp2zope.LOCK_BACKENDS)
+
+    def test_lock_and_unlock(self):
+        for backend in self.backends():
+            lock = make_lock(self.lockfile, backend)
+            self.failIf(lock.locked())
+            lock.lock()
+            self.failUnless(lock.locked())
+            self.assertRaises(AlreadyLockedError, lock.lock)
+            lock.unlock()
+            self.failIf(lock.locked())
+            self.assertRaises(NotLockedError, lock.unlock)
+            lock.unlock(unconditionally=True)
+
+    def test_times_out_while_held(self):
+        for backend in self.backends():
+            holder = make_lock(self.lockfile, backend)
+            holder.lock()
+            try:
+                waiter = make_lock(self.lockfile, backend)
+                self.assertRaises(TimeOutError, waiter.lock, 0.1)
+                self.failIf(waiter.locked())
+            finally:
+                holder.unlock()
+            waiter.lock(1)
+            waiter.unlock()
+
+    def test_waiter_gets_lock_when_released(self):
+        for backend in self.backends():
+            holder = make_lock(self.lockfile, backend)
+            holder.lock()
+            waiter = make_lock(self.lockfile, backend)
+            thread = threading.Thread(target=waiter.lock, args=(5,))
+            thread.start()
+            time.sleep(0.05)
+            self.failIf(waiter.locked())
+            holder.unlock()
+            thread.join(5)
+            self.failUnless(waiter.locked(), backend)
+            waiter.unlock()
+
+if 'flock' in smtp2zope.LOCK_BACKENDS:
+
+    class FlockLockTests(unittest.TestCase):
+
+        def setUp(self):
+            self.directory = tempfile.mkdtemp()
+            self.lockfile = os.path.join(self.directory, 'test.lock')
+
+        def tearDown(self):
+            shutil.rmtree(self.directory)
+
+        def test_link_lock_does_not_break_flock(self):
+            # Regression: both backends used the same file, which
+            # LockFile took for an expired lock, broke and removed,
+            # letting a second FlockLock in on a new file.
+            holder = make_lock(self.lockfile, 'flock')
+            holder.lock()
+            try:
+                link = LockFile(self.lockfile)
+                link.lock(1)
+                link.unlock()
+                waiter = make_lock(self.lockfile, 'flock')
+                self.assertRaises(TimeOutError, waiter.lock, 0.1)
+            finally:
+                holder.unlock()
+            self.failUnless(os.path.exists(self.lockfile + '.flock'))
+
+        def test_timed_out_waits_leave_one_helper(self):
+            holder = make_lock(self.lockfile, 'flock')
+            holder.lock()
+            flockfile = self.lockfile + '.flock'
+            try:
+                waiter = make_lock(self.lockfile, 'flock')
+                self.assertRaises(TimeOutError, waiter.lock, 0.05)
+                helper = smtp2zope._abandoned[flockfile]
+                for i in range(4):
+                    waiter = make_lock(self.lockfile, 'flock')
+                    self.assertRaises(TimeOutError, waiter.lock, 0.05)
+                    self.failUnless(smtp2zope._abandoned[flockfile] is helper)
+                self.failUnless(helper.isAlive())
+            finally:
+                holder.unlock()
+            # The abandoned helper gets the lock, gives it back and ends.
+            helper.join(5)
+            self.failIf(helper.isAlive())
+            self.failIf(flockfile in smtp2zope._abandoned)
+            waiter = make_lock(self.lockfile, 'flock')
+            waiter.lock(1)
+            waiter.unlock()
+
+if __name__ == '__main__':
+    unittest.main()
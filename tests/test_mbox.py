@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from testmailclient.mbox import (MboxSource, read_raw, split_member,
+                                 stat_mail, member_path)
+from testmailclient.reader import read_mail
+
+FIRST = """\
+From a@example.org Mon Jan  1 00:00:00 2024
+To: one@example.org
+Subject: first
+
+>From the start
+>>From quoted twice
+From within a line is fine
+
+"""
+
+SECOND_HEAD = """\
+From b@example.org Mon Jan  1 00:00:01 2024
+To: two@example.org
+Subject: second
+
+"""
+
+class MboxTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mbox = os.path.join(self.directory, 'test.mbox')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text, mode='ab'):
+        fp = open(self.mbox, mode)
+        fp.write(text)
+        fp.close()
+
+    def test_unquotes_from_lines(self):
+        self.write(FIRST)
+        [path] = MboxSource(self.mbox).paths()
+        raw = read_raw(path)
+        self.assertEqual(raw.splitlines()[3:6],
+                         ['From the start', '>From quoted twice',
+                          'From within a line is fine'])
+        record = read_mail(path)
+        self.assertEqual(record.get('Subject'), 'first')
+        self.failUnless(record.body().startswith(
+                'From the start\n>From quoted twice\n'))
+
+    def test_incomplete_last_message(self):
+        self.write(FIRST)
+        source = MboxSource(self.mbox)
+        # Still being written: no blank line at the end yet.
+        self.write(SECOND_HEAD + 'half a bo')
+        paths = source.paths()
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(read_mail(paths[0]).get('To'), 'one@example.org')
+        self.write('dy\n\n')
+        paths = source.paths()
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(read_mail(paths[1]).get('To'), 'two@example.org')
+        self.assertEqual(read_mail(paths[1]).body(), 'half a body\n')
+
+    def test_partial_blank_line(self):
+        self.write(FIRST.replace('\n', '\r\n')[:-1])
+        source = MboxSource(self.mbox)
+        self.assertEqual(source.paths(), [])
+        self.write('\n')
+        self.assertEqual(len(source.paths()), 1)
+
+    def test_clear(self):
+        self.write(FIRST)
+        source = MboxSource(self.mbox)
+        source.clear()
+        self.assertEqual(source.paths(), [])
+        self.write(SECOND_HEAD + 'body\n\n')
+        [path] = source.paths()
+        self.assertEqual(read_mail(path).get('Subject'), 'second')
+
+    def test_member_paths(self):
+        self.write(FIRST)
+        [path] = MboxSource(self.mbox).paths()
+        mbox, start, end = split_member(path)
+        self.assertEqual(mbox, self.mbox)
+        self.assertEqual(path, member_path(mbox, start, end))
+        self.assertEqual(stat_mail(path), (end - start, 0))
+        self.assertEqual(split_member(self.mbox), (self.mbox, None, None))
+
+    def test_truncated(self):
+        self.write(FIRST + SECOND_HEAD + 'body\n\n')
+        source = MboxSource(self.mbox)
+        self.assertEqual(len(source.paths()), 2)
+        self.write(SECOND_HEAD + 'other\n\n', 'wb')
+        [path] = source.paths()
+        self.assertEqual(read_mail(path).body(), 'other\n')
+
+if __name__ == '__main__':
+    unittest.main()
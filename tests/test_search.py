@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from testmailclient.reader import read_mail
+from testmailclient.search import MultiSearch, search_mails
+
+class MultiSearchTests(unittest.TestCase):
+
+    def search(self, needles, text, regex=False):
+        return MultiSearch(needles, regex).search(text)
+
+    def test_literals(self):
+        self.assertEqual(self.search(['abc', 'b', 'zz'], 'xabcx'),
+                         [True, True, False])
+
+    def test_literals_are_not_patterns(self):
+        self.assertEqual(self.search(['a.c', '(?i)x'], 'abc (?i)x'),
+                         [False, True])
+
+    def test_inline_flags_stay_in_their_pattern(self):
+        needles = ['(?i)hello', 'World']
+        self.assertEqual(self.search(needles, 'world only', True),
+                         [False, False])
+        self.assertEqual(self.search(needles, 'HELLO World', True),
+                         [True, True])
+
+    def test_same_group_name(self):
+        self.assertEqual(self.search(['(?P<x>a)', '(?P<x>b)'], 'b', True),
+                         [False, True])
+
+    def test_backreferences(self):
+        self.assertEqual(self.search([r'(\w)\1', 'q'], 'abba', True),
+                         [True, False])
+
+    def test_many_groups(self):
+        needles = ['(n%d)(x)' % i for i in range(120)]
+        found = self.search(needles, 'n7x n119x', True)
+        self.assertEqual([i for i, hit in enumerate(found) if hit], [7, 119])
+
+class SearchMailsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def mail(self, name, text):
+        path = os.path.join(self.directory, name)
+        fp = open(path, 'wb')
+        fp.write(text)
+        fp.close()
+        return read_mail(path)
+
+    def test_rows_per_mail(self):
+        records = [
+            self.mail('a', 'To: a\nContent-Transfer-Encoding: base64\n\n'
+                      'aGVsbG8gd29ybGQ=\n'),
+            self.mail('b', 'To: b\nContent-Transfer-Encoding: base64\n\n'
+                      'aGVsbG8gd29ybGQ=\n'),
+            # The same body, but not encoded: a different text.
+            self.mail('c', 'To: c\n\naGVsbG8gd29ybGQ=\n')]
+        rows = search_mails(records, ['hello', 'aGVs'])
+        self.assertEqual([(os.path.basename(path), found)
+                          for path, found in rows],
+                         [('a', [True, False]), ('b', [True, False]),
+                          ('c', [False, True])])
+        self.failIf(rows[0][1] is rows[1][1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from twill import get_browser
+
+import testmailclient
+from testmailclient.receiver import MailReceiver, write_spool
+
+class SendMailsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.receiver = MailReceiver(os.path.join(self.directory, 'spool'),
+                                     lists=['list']).start()
+        self.url = '%slists/list/manage_mailboxer' % self.receiver.url
+        self.outgoing = os.path.join(self.directory, 'outgoing')
+        write_spool(self.outgoing, 2)
+        testmailclient.use_mail_cookie()
+        get_browser().cj.clear()
+
+    def tearDown(self):
+        testmailclient.use_mail_cookie()
+        get_browser().cj.clear()
+        self.receiver.stop()
+        shutil.rmtree(self.directory)
+
+    def test_adds_each_mail_once_while_spool_in_use(self):
+        # Regression: the mails found in the spool were added to the
+        # cookie as well as the ones the receiver reported.
+        testmailclient.use_mail_spool(self.receiver.spool)
+        testmailclient.send_mails(self.outgoing, self.url)
+        self.assertEqual(len(testmailclient.get_mail()), 2)
+        testmailclient.use_mail_cookie()
+        self.assertEqual(sorted(testmailclient.get_mail()),
+                         sorted(os.path.join(self.receiver.spool, name)
+                                for name in os.listdir(self.receiver.spool)))
+
+    def test_keeps_mails_sent_before_a_read_error(self):
+        os.symlink(os.path.join(self.directory, 'missing'),
+                   os.path.join(self.outgoing, 'mail-999999.eml'))
+        self.assertRaises(IOError, testmailclient.send_mails,
+                          os.path.join(self.outgoing, '*'), self.url)
+        self.assertEqual(len(testmailclient.get_mail()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
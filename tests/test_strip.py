@@ -0,0 +1,85 @@
+import email
+import unittest
+from StringIO import StringIO
+
+from testmailclient.strip import (strip_attachments, EVENT_STRIPPED_HTML,
+                                  EVENT_STRIPPED_ATTACHMENTS)
+
+NESTED = """\
+From: a@example.org
+To: list@example.org
+Subject: nested
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="outer"
+
+preamble
+--outer
+Content-Type: multipart/alternative; boundary="inner"
+
+--inner
+Content-Type: text/plain; charset=utf-8
+Content-Transfer-Encoding: quoted-printable
+
+Hello =C3=A9
+second line
+--inner
+Content-Type: text/html
+
+<p>Hello</p>
+--inner--
+--outer
+Content-Type: application/octet-stream
+Content-Disposition: attachment; filename="data.bin"
+Content-Transfer-Encoding: base64
+
+QUFBQUFBQUFBQUFB
+--outer--
+epilogue
+"""
+
+def _strip(text):
+    return strip_attachments(StringIO(text))
+
+class StripAttachmentsTests(unittest.TestCase):
+
+    def test_not_multipart(self):
+        self.assertEqual(_strip('Subject: x\n\nbody\n'), (None, []))
+
+    def test_only_text(self):
+        mail = ('Content-Type: multipart/mixed; boundary="b"\n\n'
+                '--b\nContent-Type: text/plain\n\ntext\n--b--\n')
+        self.assertEqual(_strip(mail), (None, []))
+
+    def test_nested_multipart(self):
+        mail, codes = _strip(NESTED)
+        self.assertEqual(codes, [EVENT_STRIPPED_HTML,
+                                 EVENT_STRIPPED_ATTACHMENTS])
+        msg = email.message_from_string(mail)
+        self.assertEqual(msg['Subject'], 'nested')
+        self.assertEqual(msg.get_content_type(), 'text/plain')
+        self.assertEqual(msg['Content-Transfer-Encoding'], 'quoted-printable')
+        self.assertEqual(msg.get_payload(decode=True),
+                         'Hello \xc3\xa9\nsecond line')
+        self.failIf('QUFB' in mail)
+        self.failIf('<p>' in mail)
+        self.failIf('boundary' in mail)
+
+    def test_crlf(self):
+        mail, codes = _strip(NESTED.replace('\n', '\r\n'))
+        self.assertEqual(codes, [EVENT_STRIPPED_HTML,
+                                 EVENT_STRIPPED_ATTACHMENTS])
+        head, body = mail.split('\r\n\r\n', 1)
+        self.failIf('\n' in head.replace('\r\n', ''))
+        self.assertEqual(body, 'Hello =C3=A9\r\nsecond line')
+
+    def test_no_text_part(self):
+        mail = ('Subject: x\nContent-Type: multipart/mixed; boundary="b"\n\n'
+                '--b\nContent-Type: image/png\n\nPNG\n--b--\n')
+        mail, codes = _strip(mail)
+        self.assertEqual(codes, [EVENT_STRIPPED_ATTACHMENTS])
+        msg = email.message_from_string(mail)
+        self.assertEqual(msg.get_content_type(), 'text/plain')
+        self.assertEqual(msg.get_payload(), '')
+
+if __name__ == '__main__':
+    unittest.main()